@@ -46,6 +46,23 @@ class CustomFieldSettingAdmin(admin.ModelAdmin):
     readonly_fields = (asana_link, "gid")
 
 
+@admin.register(models.Event)
+class EventAdmin(admin.ModelAdmin):
+    exclude = ("payload",)
+    list_display = ("__str__", "project_id", "created_at")
+    readonly_fields = (
+        "action",
+        "created_at",
+        "gid",
+        "logged_at",
+        "project",
+        "resource_type",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(models.Project)
 class ProjectAdmin(admin.ModelAdmin):
     date_hierarchy = "created_at"
@@ -218,6 +235,22 @@ class WebhookAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(models.WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "project", "attempts", "claimed_at")
+    readonly_fields = (
+        "payload",
+        "project",
+        "received_at",
+        "attempts",
+        "claimed_at",
+        "error",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(models.Workspace)
 class WorkspaceAdmin(admin.ModelAdmin):
     exclude = ("resource_type",)
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+from collections import deque
+
+from asana.error import ForbiddenError, InvalidRequestError, NotFoundError
+
+from djasana.connect import async_client_connect
+from djasana.models import Attachment, Story, Task
+from djasana.synchronizer import AsanaSynchronizer, newer_stories
+from djasana.utils import get_opt_fields, is_complete
+
+
+class AsyncAsanaSynchronizer(AsanaSynchronizer):
+    """An AsanaSynchronizer that reads tasks from Asana with asyncio.
+
+    Tasks and their subtasks, attachments and stories are read by coroutines on an
+    event loop running in a background thread, through one pooled AsyncClient.
+    Up to max_tasks tasks of a project are read at a time, and up to
+    max_requests_per_task requests for each task. Bundles come back to the calling
+    thread, which writes them to the database in order, as AsanaSynchronizer
+    does. Everything other than tasks is read with the regular client.
+    """
+
+    def __init__(self, *args, max_tasks=50, max_requests_per_task=4, **kwargs):
+        self.max_tasks = max(max_tasks or 1, 1)
+        self.max_requests_per_task = max(max_requests_per_task or 1, 1)
+        self._loop = None
+        self._thread = None
+        self.async_client = None
+        super(AsyncAsanaSynchronizer, self).__init__(*args, **kwargs)
+        self.options.update(
+            max_tasks=self.max_tasks, max_requests_per_task=self.max_requests_per_task
+        )
+
+    def close(self):
+        super(AsyncAsanaSynchronizer, self).close()
+        if self._loop is not None:
+            self._submit(self.async_client.aclose()).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self.async_client = None
+
+    def _submit(self, coroutine):
+        """Schedules a coroutine on the event loop; returns a concurrent Future"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, name="djasana-async", daemon=True
+            )
+            self._thread.start()
+            self.async_client = async_client_connect()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _fetch_tasks(
+            self, tasks, models, skip_subtasks=False, unchanged=(), watermarks=None
+    ):
+        """Yields task bundles in the order of tasks, reading max_tasks at a time"""
+        watermarks = watermarks or {}
+        pending = deque()
+        for task in tasks:
+            pending.append(
+                self._submit(
+                    self._fetch_task_async(
+                        task,
+                        models,
+                        skip_subtasks=skip_subtasks,
+                        unchanged=task["gid"] in unchanged,
+                        watermark=watermarks.get(task["gid"]),
+                    )
+                )
+            )
+            if len(pending) >= self.max_tasks:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    async def _get_full_record_async(self, resource, record, model):
+        fields = get_opt_fields(model)
+        if is_complete(record, fields):
+            return record
+        return await self.async_client.get(
+            f"/{resource}/{record['gid']}", fields=fields
+        )
+
+    async def _get_full_records_async(self, resource, path, model, slots):
+        """Returns the complete records of a collection, skipping vanished ones"""
+        fields = get_opt_fields(model)
+        async with slots:
+            records = [
+                record
+                async for record in self.async_client.get_collection(
+                    path, fields=fields
+                )
+            ]
+        return await self._complete_records_async(resource, records, model, slots)
+
+    async def _list_new_stories_async(self, task_id, watermark, slots):
+        """Reads the stories of a task from its watermark on, like _list_new_stories
+
+        Returns the complete stories and the new watermark.
+        """
+        path = f"/tasks/{task_id}/stories"
+        fields = get_opt_fields(Story)
+
+        async def read_from(offset):
+            async with slots:
+                return [
+                    (page_offset, story)
+                    async for page_offset, stories in self.async_client.get_pages(
+                        path, {"offset": offset} if offset else None, fields
+                    )
+                    for story in stories
+                ]
+
+        offset = watermark[0] if watermark else None
+        try:
+            pages = await read_from(offset)
+        except InvalidRequestError:
+            if not offset:
+                raise
+            # Asana offsets expire; read the task's stories from the start.
+            watermark = (None, watermark[1])
+            pages = await read_from(None)
+        stories, watermark = newer_stories(pages, watermark)
+        stories = await self._complete_records_async("stories", stories, Story, slots)
+        return stories, watermark
+
+    async def _complete_records_async(self, resource, records, model, slots):
+        """Returns the complete records of those listed, skipping vanished ones"""
+
+        async def get_full_record(record):
+            async with slots:
+                try:
+                    return await self._get_full_record_async(resource, record, model)
+                except NotFoundError as error:
+                    self.logger.info(error)
+                    return None
+
+        full_records = await asyncio.gather(
+            *(get_full_record(record) for record in records)
+        )
+        return [record for record in full_records if record is not None]
+
+    async def _fetch_task_async(
+            self, task, models, skip_subtasks=False, unchanged=False, watermark=None
+    ):
+        """Collects everything needed to write this task, like _fetch_task"""
+        task_id = task["gid"]
+        bundle = {
+            "gid": task_id,
+            "task": None,
+            "unchanged": unchanged,
+            "subtasks": [],
+            "attachments": [],
+            "stories": [],
+            "story_watermark": None,
+        }
+        slots = asyncio.Semaphore(self.max_requests_per_task)
+        try:
+            async with slots:
+                bundle["task"] = (
+                    task
+                    if unchanged
+                    else await self._get_full_record_async("tasks", task, Task)
+                )
+        except (ForbiddenError, NotFoundError):
+            return bundle
+        if not self.commit:
+            return bundle
+        reads = {}
+        has_subtasks = bundle["task"].get("num_subtasks", 1)
+        if Task in models and not skip_subtasks and has_subtasks:
+            reads["subtasks"] = self._get_full_records_async(
+                "tasks", f"/tasks/{task_id}/subtasks", Task, slots
+            )
+        if Attachment in models and not unchanged:
+            reads["attachments"] = self._get_full_records_async(
+                "attachments", f"/tasks/{task_id}/attachments", Attachment, slots
+            )
+        if Story in models and not unchanged:
+            reads["stories"] = self._list_new_stories_async(task_id, watermark, slots)
+        results = await asyncio.gather(*reads.values())
+        bundle.update(zip(reads, results))
+        if "stories" in reads:
+            bundle["stories"], bundle["story_watermark"] = bundle["stories"]
+        return bundle
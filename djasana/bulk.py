@@ -0,0 +1,273 @@
+"""Buffered, batched writes of Asana objects to the database"""
+import logging
+from collections import defaultdict
+
+from django.db import connections, transaction
+
+from djasana.models import (
+    Attachment,
+    CustomField,
+    CustomFieldSetting,
+    Project,
+    Story,
+    Tag,
+    Task,
+    Team,
+    User,
+    Workspace,
+)
+
+logger = logging.getLogger(__name__)
+
+# Models in the order their rows are written, so foreign keys point at rows that exist.
+WRITE_ORDER = (
+    Workspace,
+    User,
+    Team,
+    Tag,
+    Project,
+    CustomField,
+    CustomFieldSetting,
+    Task,
+    Attachment,
+    Story,
+)
+
+UNIQUE_FIELDS = ("remote_id", "gid")
+
+
+class BulkWriter(object):
+    """Collects normalized rows of Asana objects and writes them in batches.
+
+    Rows are keyed by remote_id. Rows passed to upsert() are created or have the
+    fields they carry updated, like update_or_create. Rows passed to insert() are
+    only created if no row with that remote_id exists, like get_or_create.
+
+    Everything buffered is written, in WRITE_ORDER, when batch_size rows are pending
+    or when flush() is called. Each flush is one transaction.
+
+    With an IdentityMap, inserts of rows the map knows exist are dropped, and rows
+    related through many-to-many fields are looked up in the map first.
+    """
+
+    def __init__(self, batch_size=500, using="default", identity=None):
+        self.batch_size = batch_size
+        self.using = using
+        self.identity = identity
+        self._upserts = {model: {} for model in WRITE_ORDER}
+        self._inserts = {model: {} for model in WRITE_ORDER}
+        self._m2m = []
+        self.pending = 0
+
+    def upsert(self, model, remote_id, values):
+        rows = self._upserts[model]
+        remote_id = int(remote_id)
+        if remote_id in rows:
+            rows[remote_id].update(values)
+        else:
+            rows[remote_id] = dict(values)
+            self._added()
+
+    def insert(self, model, remote_id, values):
+        rows = self._inserts[model]
+        remote_id = int(remote_id)
+        if self.identity is not None and self.identity.known(model, remote_id):
+            return
+        if remote_id not in rows:
+            rows[remote_id] = dict(values)
+            self._added()
+
+    def set_m2m(self, model, field_name, remote_id, target_ids):
+        """Makes target_ids the related objects of a row, like RelatedManager.set()
+
+        Both the row and its targets are identified by remote_id. Targets that do
+        not exist when the rows are flushed are skipped.
+        """
+        self._m2m.append((model, field_name, int(remote_id), target_ids, True))
+
+    def add_m2m(self, model, field_name, remote_id, target_ids):
+        """Adds target_ids to the related objects of a row, like RelatedManager.add()"""
+        self._m2m.append((model, field_name, int(remote_id), target_ids, False))
+
+    def clear(self):
+        """Drops everything buffered and not yet written"""
+        self._upserts = {model: {} for model in WRITE_ORDER}
+        self._inserts = {model: {} for model in WRITE_ORDER}
+        self._m2m = []
+        self.pending = 0
+
+    def _added(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not (self.pending or self._m2m):
+            return
+        written = []
+        with transaction.atomic(using=self.using):
+            for model in WRITE_ORDER:
+                if self._inserts[model]:
+                    self._insert(model, self._inserts[model])
+                    written.append((model, self._inserts[model]))
+                    self._inserts[model] = {}
+                if self._upserts[model]:
+                    self._upsert(model, self._upserts[model])
+                    written.append((model, self._upserts[model]))
+                    self._upserts[model] = {}
+            self._write_m2m()
+        if self.identity is not None:
+            for model, rows in written:
+                for remote_id in rows:
+                    self.identity.add(model, remote_id)
+        logger.debug("Flushed %s rows", self.pending)
+        self.pending = 0
+
+    def _write_m2m(self):
+        relations, self._m2m = self._m2m, []
+        # Collapse the buffered calls into the wanted targets of each row, so a
+        # later set_m2m() replaces what earlier calls asked for.
+        wanted = defaultdict(dict)
+        for model, field_name, remote_id, target_ids, replace in relations:
+            rows = wanted[(model, field_name)]
+            target_ids = {int(target_id) for target_id in target_ids}
+            if replace or remote_id not in rows:
+                rows[remote_id] = (replace, target_ids)
+            else:
+                rows[remote_id][1].update(target_ids)
+        for (model, field_name), rows in wanted.items():
+            self._diff_m2m(model, field_name, rows)
+
+    def _pks(self, model, remote_ids):
+        pks = {}
+        missing = []
+        for remote_id in remote_ids:
+            pk = self.identity.get(model, remote_id) if self.identity else None
+            if pk is None:
+                missing.append(remote_id)
+            else:
+                pks[remote_id] = pk
+        if missing:
+            rows = (
+                model._default_manager.using(self.using)
+                .filter(remote_id__in=missing)
+                .values_list("remote_id", "pk")
+            )
+            for remote_id, pk in rows:
+                pks[remote_id] = pk
+                if self.identity is not None:
+                    self.identity.add(model, remote_id, pk)
+        return pks
+
+    def _diff_m2m(self, model, field_name, rows):
+        """Brings the through table of one many-to-many field in line with rows.
+
+        The number of queries does not depend on the number of rows: at most one
+        to look up the rows, one for their targets, one for the pairs that already
+        exist, one delete and one bulk_create.
+        """
+        field = model._meta.get_field(field_name)
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        source_pks = self._pks(model, rows)
+        target_pks = self._pks(
+            field.related_model,
+            set().union(*(target_ids for _, target_ids in rows.values())),
+        )
+        pairs = set()
+        replaced = set()
+        for remote_id, (replace, target_ids) in rows.items():
+            pk = source_pks.get(remote_id)
+            if pk is None:
+                continue
+            if replace:
+                replaced.add(pk)
+            pairs.update(
+                (pk, target_pks[target_id])
+                for target_id in target_ids
+                if target_id in target_pks
+            )
+        manager = through._default_manager.using(self.using)
+        ignore_conflicts = self.features.supports_ignore_conflicts
+        checked = list(replaced) if ignore_conflicts else list(source_pks.values())
+        existing = set()
+        stale = []
+        if checked:
+            for pk, source_pk, target_pk in manager.filter(
+                **{source + "__in": checked}
+            ).values_list("pk", source, target):
+                if (source_pk, target_pk) in pairs:
+                    existing.add((source_pk, target_pk))
+                elif source_pk in replaced:
+                    stale.append(pk)
+        if stale:
+            manager.filter(pk__in=stale).delete()
+        manager.bulk_create(
+            [
+                through(**{source: source_pk, target: target_pk})
+                for source_pk, target_pk in pairs - existing
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=ignore_conflicts,
+        )
+
+    @property
+    def features(self):
+        return connections[self.using].features
+
+    @staticmethod
+    def _instance(model, remote_id, values):
+        kwargs = dict(values, remote_id=remote_id)
+        kwargs.setdefault("gid", str(remote_id))
+        return model(**kwargs)
+
+    def _insert(self, model, rows):
+        manager = model._default_manager.using(self.using)
+        if not self.features.supports_ignore_conflicts:
+            existing = set(
+                manager.filter(remote_id__in=rows).values_list("remote_id", flat=True)
+            )
+            rows = {key: value for key, value in rows.items() if key not in existing}
+        manager.bulk_create(
+            [self._instance(model, key, value) for key, value in rows.items()],
+            batch_size=self.batch_size,
+            ignore_conflicts=self.features.supports_ignore_conflicts,
+        )
+
+    def _upsert(self, model, rows):
+        # Rows carrying the same fields can share one statement.
+        groups = defaultdict(dict)
+        for remote_id, values in rows.items():
+            update_fields = tuple(sorted(set(values) - set(UNIQUE_FIELDS)))
+            groups[update_fields][remote_id] = values
+        for update_fields, group in groups.items():
+            if not update_fields:
+                self._insert(model, group)
+            elif getattr(self.features, "supports_update_conflicts_with_target", False):
+                model._default_manager.using(self.using).bulk_create(
+                    [self._instance(model, key, value) for key, value in group.items()],
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=["remote_id"],
+                    update_fields=update_fields,
+                )
+            else:
+                self._update_or_create(model, group, update_fields)
+
+    def _update_or_create(self, model, rows, update_fields):
+        """Upserts for backends without INSERT ... ON CONFLICT on a target"""
+        manager = model._default_manager.using(self.using)
+        existing = dict(
+            manager.filter(remote_id__in=rows).values_list("remote_id", "pk")
+        )
+        to_create, to_update = [], []
+        for remote_id, values in rows.items():
+            instance = self._instance(model, remote_id, values)
+            if remote_id in existing:
+                instance.pk = existing[remote_id]
+                to_update.append(instance)
+            else:
+                to_create.append(instance)
+        manager.bulk_create(to_create, batch_size=self.batch_size)
+        manager.bulk_update(to_update, update_fields, batch_size=self.batch_size)
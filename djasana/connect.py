@@ -1,29 +1,489 @@
+import asyncio
 import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from requests.exceptions import ChunkedEncodingError
 
 from asana import Client as AsanaClient
-from asana.error import ServerError
+from asana.client import STATUS_MAP
+from asana.page_iterator import CollectionPageIterator
+from asana.error import (
+    AsanaError,
+    RateLimitEnforcedError,
+    RetryableAsanaError,
+    ServerError,
+)
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+try:
+    import httpx
+except ImportError:  # Only needed by AsyncClient
+    httpx = None
+
 
 logger = logging.getLogger(__name__)
 
+# The largest page Asana returns from a collection endpoint.
+PAGE_SIZE = 100
+
+_prefetch_executor = None
+_prefetch_lock = threading.Lock()
+
+
+def get_prefetch_executor():
+    """The thread pool shared by all PrefetchingPageIterators"""
+    global _prefetch_executor
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "ASANA_PREFETCH_THREADS", 8),
+                thread_name_prefix="djasana-prefetch",
+            )
+        return _prefetch_executor
+
+
+class RateLimiter(object):
+    """Paces requests to Asana with a token bucket and a cap on concurrency.
+
+    The bucket holds one minute's worth of requests and refills continuously.
+    When Asana answers 429, call throttle() with its Retry-After value and
+    every request waits exactly that long before going out again.
+    """
+
+    def __init__(self, requests_per_minute=150, max_concurrent=50):
+        self.capacity = float(requests_per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.wait_time = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        """Takes tokens and returns the seconds to wait before they may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= tokens
+            delay = max(self.paused_until - now, -self.tokens / self.rate, 0.0)
+            self.wait_time += delay
+            return delay
+
+    def acquire(self):
+        self._slots.acquire()
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def release(self):
+        self._slots.release()
+
+    def throttle(self, retry_after):
+        """Pauses all requests for as long as Asana asked us to."""
+        with self._lock:
+            self.throttled += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.tokens = min(self.tokens, 0.0)
+
+    @property
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "wait_time": round(self.wait_time, 3),
+                "throttled": self.throttled,
+                "tokens": int(max(self.tokens, 0)),
+            }
+
+
+def asana_error(response):
+    """Returns the asana error for an error response, as python-asana raises it"""
+    status = response.status_code
+    error_class = STATUS_MAP.get(status)
+    if error_class is None and status and 500 <= status < 600:
+        error_class = ServerError
+    try:
+        return error_class(response)
+    except Exception:
+        return AsanaError(message="Request failed", status=status, response=response)
+
+
+class BatchFuture(Future):
+    """The result of a read queued on a Batch; asking for it sends the batch"""
+
+    def __init__(self, batch):
+        super(BatchFuture, self).__init__()
+        self._batch = batch
+
+    def result(self, timeout=None):
+        if not self.done():
+            self._batch.flush()
+        return super(BatchFuture, self).result(timeout)
+
+    def exception(self, timeout=None):
+        if not self.done():
+            self._batch.flush()
+        return super(BatchFuture, self).exception(timeout)
+
+
+class BatchResponse(object):
+    """Looks like a requests response to the asana error classes"""
+
+    def __init__(self, result):
+        self.status_code = result.get("status_code")
+        self.headers = result.get("headers") or {}
+        self.body = result.get("body") or {}
+
+    def json(self):
+        return self.body
+
+
+class Batch(object):
+    """Collects GET requests and sends them through Asana's /batch endpoint.
+
+    get() returns a future. Reads go out MAX_ACTIONS at a time, as soon as that
+    many are queued, when flush() is called, when the batch is used as a context
+    manager and exits, or when the result of a pending future is asked for. A read
+    that fails sets the same error on its future that the single request would
+    have raised.
+    """
+
+    MAX_ACTIONS = 10
+
+    def __init__(self, client):
+        self.client = client
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def get(self, path, fields=None):
+        action = {"method": "get", "relative_path": path}
+        if fields:
+            action["options"] = {"fields": list(fields)}
+        future = BatchFuture(self)
+        with self._lock:
+            self._pending.append((action, future))
+            if len(self._pending) < self.MAX_ACTIONS:
+                return future
+            actions, self._pending = self._pending, []
+        self._send(actions)
+        return future
+
+    def flush(self):
+        with self._lock:
+            actions, self._pending = self._pending, []
+        for start in range(0, len(actions), self.MAX_ACTIONS):
+            self._send(actions[start:start + self.MAX_ACTIONS])
+
+    def _send(self, actions):
+        limiter = self.client.rate_limiter
+        if limiter and len(actions) > 1:
+            # Asana counts every action against the rate limit, not the request.
+            delay = limiter.reserve(len(actions) - 1)
+            if delay:
+                time.sleep(delay)
+        try:
+            results = self.client.post(
+                "/batch", {"actions": [action for action, _ in actions]}
+            )
+        except Exception as error:
+            for _, future in actions:
+                future.set_exception(error)
+            return
+        for (action, future), result in zip(actions, results):
+            response = BatchResponse(result)
+            if 200 <= (response.status_code or 0) < 300:
+                future.set_result(response.body.get("data"))
+            else:
+                future.set_exception(asana_error(response))
+
+
+class PageItems(object):
+    """Iterates over the items of a PrefetchingPageIterator, page by page
+
+    offset is the offset of the page the last item returned came from, which is
+    where to resume to see that item again.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._page = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self._page)
+            except StopIteration:
+                self._page = iter(next(self.pages) or [])
+
+    @property
+    def offset(self):
+        return self.pages.offset
+
+
+class PrefetchingPageIterator(CollectionPageIterator):
+    """Iterates over the pages of a collection, fetching the next in the background
+
+    While the caller works through one page, the next one is requested on a
+    thread, so at most two pages are held at a time. If the connection drops in
+    the middle of a page, that page is requested again from its offset rather
+    than starting the collection over.
+    """
+
+    def __init__(self, client, path, query, options):
+        super(PrefetchingPageIterator, self).__init__(client, path, query, options)
+        self.offset = None
+        self._next_page = None
+
+    def __next__(self):
+        self.options["limit"] = min(self.page_size, self.item_limit - self.count)
+        if self.continuation is None or self.options["limit"] <= 0:
+            raise StopIteration
+        offset = (
+            self.continuation["offset"]
+            if self.continuation
+            else self.options.get("offset")
+        )
+        if self._next_page is None:
+            result = self._fetch(offset, self.options["limit"])
+        else:
+            result = self._next_page.result()
+            self._next_page = None
+        self.offset = offset
+        self.continuation = result.get(self.CONTINUATION_KEY, None)
+        data = result.get("data", None)
+        if data is not None:
+            self.count += len(data)
+        limit = min(self.page_size, self.item_limit - self.count)
+        if self.continuation and limit > 0:
+            self._next_page = get_prefetch_executor().submit(
+                self._fetch, self.continuation["offset"], limit
+            )
+        return data
+
+    def items(self):
+        return PageItems(self)
+
+    def _fetch(self, offset, limit):
+        # Client.request retries a broken connection, requesting this page again.
+        options = dict(self.options, limit=limit)
+        if offset:
+            options["offset"] = offset
+        return self.client.get(self.path, self.query, **options)
+
 
 class Client(AsanaClient, object):
     """An http client for making requests to an Asana API and receiving responses."""
 
+    rate_limiter = None
+
+    def batch(self):
+        """Returns a Batch for grouping GET requests, up to ten per request"""
+        return Batch(self)
+
+    def get_collection(self, path, query, **options):
+        """Gets a collection, PAGE_SIZE items per request, prefetching pages"""
+        options = self._merge_options({"page_size": PAGE_SIZE}, options)
+        if options["iterator_type"] == "items":
+            return PrefetchingPageIterator(self, path, query, options).items()
+        return super(Client, self).get_collection(path, query, **options)
+
     def request(self, method, path, **options):
+        """Dispatches a request, retrying errors Asana says are temporary.
+
+        Retries are handled here rather than by python-asana so that a 429 pauses
+        every request sharing the rate limiter, not just this one.
+        """
         logger.debug("%s, %s", method, path)
-        try:
-            return super(Client, self).request(method, path, **options)
-        except (SystemExit, ServerError, ChunkedEncodingError):
-            logger.error("Error for %s, %s with options %s", method, path, options)
-            # Try once more
-            return super(Client, self).request(method, path, **options)
+        max_retries = self._merge_options(options)["max_retries"]
+        options["max_retries"] = 0
+        retries = 0
+        while True:
+            try:
+                with self.rate_limiter or nullcontext():
+                    return super(Client, self).request(method, path, **options)
+            except RateLimitEnforcedError as error:
+                if retries >= max_retries:
+                    raise
+                retry_after = error.retry_after or self.RETRY_DELAY
+                logger.warning(
+                    "Rate limited for %s, %s; waiting %s seconds",
+                    method,
+                    path,
+                    retry_after,
+                )
+                if self.rate_limiter:
+                    self.rate_limiter.throttle(retry_after)
+                else:
+                    time.sleep(retry_after)
+            except (SystemExit, RetryableAsanaError, ChunkedEncodingError):
+                if retries >= max_retries:
+                    raise
+                logger.error("Error for %s, %s with options %s", method, path, options)
+                time.sleep(self.RETRY_DELAY * (self.RETRY_BACKOFF ** retries))
+            retries += 1
+
+
+def get_rate_limiter():
+    """Returns a RateLimiter configured by settings, or None if pacing is disabled"""
+    requests_per_minute = getattr(settings, "ASANA_RATE_LIMIT", 150)
+    if not requests_per_minute:
+        return None
+    return RateLimiter(
+        requests_per_minute=requests_per_minute,
+        max_concurrent=getattr(settings, "ASANA_MAX_CONCURRENT_REQUESTS", 50),
+    )
+
+
+class NameIndex(object):
+    """Asana objects of one listing, indexed by gid and by name.
+
+    When several objects share a name, the first one listed wins.
+    """
+
+    def __init__(self, records):
+        self.gids = []
+        self._by_gid = {}
+        self._by_name = {}
+        for record in records:
+            gid = record["gid"]
+            self.gids.append(gid)
+            self._by_gid[gid] = record
+            self._by_name.setdefault(record["name"], gid)
+
+    def get(self, key):
+        """Returns the gid of the object with this gid or name, or None"""
+        if key in self._by_gid:
+            return key
+        return self._by_name.get(key)
+
+    def resolve(self, keys):
+        """Returns the gids of the objects with these gids or names, and the keys
+        that match none"""
+        gids = []
+        unknown = []
+        for key in keys:
+            gid = self.get(key)
+            if gid is None:
+                unknown.append(key)
+            else:
+                gids.append(gid)
+        return gids, unknown
+
 
+class Resolver(object):
+    """Resolves names and gids of workspaces and projects for a client.
 
-def client_connect():
+    Each listing is read from Asana once, the first time it is needed.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._workspaces = None
+        self._projects = {}
+
+    def workspaces(self):
+        if self._workspaces is None:
+            self._workspaces = NameIndex(self.client.workspaces.find_all())
+        return self._workspaces
+
+    def projects(self, workspace_id):
+        if workspace_id not in self._projects:
+            self._projects[workspace_id] = NameIndex(
+                self.client.projects.find_all({"workspace": workspace_id})
+            )
+        return self._projects[workspace_id]
+
+
+_resolvers = weakref.WeakKeyDictionary()
+
+
+def get_resolver(client, refresh=False):
+    """Returns the Resolver shared by everything that uses this client
+
+    With refresh, listings read before are dropped.
+    """
+    if refresh or client not in _resolvers:
+        _resolvers[client] = Resolver(client)
+    return _resolvers[client]
+
+
+_clients = threading.local()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_unset = object()
+
+
+def client_connect(pooled=True):
+    """Returns an Asana client configured by the settings.
+
+    Clients are pooled per thread: later calls with the same settings get the same
+    client back, so its connections stay open and ASANA_WORKSPACE is resolved
+    once. With pooled=False, a new client is built every time. All the clients of
+    the process with the same settings, async_client_connect's too, share one
+    RateLimiter, so together they keep to ASANA_RATE_LIMIT and all pause on a 429.
+    """
+    key = _settings_key()
+    if pooled:
+        pooled_key, client = getattr(_clients, "entry", (None, None))
+        if client is not None and pooled_key == key:
+            return client
+    client = _new_client(_shared_rate_limiter(key))
+    if pooled:
+        _clients.entry = (key, client)
+    return client
+
+
+def _settings_key():
+    return (Client,) + tuple(
+        getattr(settings, name, _unset)
+        for name in (
+            "ASANA_ACCESS_TOKEN",
+            "ASANA_CLIENT_ID",
+            "ASANA_CLIENT_SECRET",
+            "ASANA_OAUTH_REDIRECT_URI",
+            "ASANA_WORKSPACE",
+            "ASANA_RATE_LIMIT",
+            "ASANA_MAX_CONCURRENT_REQUESTS",
+        )
+    )
+
+
+def _shared_rate_limiter(key):
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = get_rate_limiter()
+        return _rate_limiters[key]
+
+
+def _new_client(rate_limiter=None):
     if getattr(settings, "ASANA_ACCESS_TOKEN", None):
         client = Client.access_token(settings.ASANA_ACCESS_TOKEN)
     elif (
@@ -42,10 +502,147 @@ def client_connect():
             + "ASANA_CLIENT_ID, ASANA_CLIENT_SECRET, and ASANA_OAUTH_REDIRECT_URI."
         )
 
+    client.rate_limiter = rate_limiter
+
     if getattr(settings, "ASANA_WORKSPACE", None):
-        workspaces = client.workspaces.find_all()
-        for workspace in workspaces:
-            if settings.ASANA_WORKSPACE == workspace["name"]:
-                client.options["workspace_id"] = workspace["gid"]
+        workspace_id = get_resolver(client).workspaces().get(settings.ASANA_WORKSPACE)
+        if workspace_id is not None:
+            client.options["workspace_id"] = workspace_id
     client.options["Asana-Fast-Api"] = "true"
     return client
+
+
+class AsyncClient(object):
+    """A minimal asyncio client for reading from the Asana API, built on httpx.
+
+    Requests share one pool of connections and the same RateLimiter pacing as
+    Client. Errors are raised as the same asana error classes, and temporary ones
+    are retried the same way.
+    """
+
+    BASE_URL = "https://app.asana.com/api/1.0"
+    MAX_RETRIES = 5
+    RETRY_DELAY = Client.RETRY_DELAY
+    RETRY_BACKOFF = Client.RETRY_BACKOFF
+
+    def __init__(self, access_token, rate_limiter=None, max_connections=100, **kwargs):
+        if httpx is None:
+            raise ImproperlyConfigured(
+                "httpx is required to sync asynchronously: "
+                "pip install django-asana[async]"
+            )
+        self.rate_limiter = rate_limiter
+        self.max_connections = max_connections
+        self.session = httpx.AsyncClient(
+            base_url=self.BASE_URL,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Asana-Fast-Api": "true",
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=60.0,
+            **kwargs,
+        )
+        self._slots = None
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def _acquire(self):
+        if self._slots is None:
+            # Created here so that it belongs to the running event loop.
+            self._slots = asyncio.Semaphore(self.max_connections)
+        await self._slots.acquire()
+        if self.rate_limiter:
+            delay = self.rate_limiter.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def request(self, method, path, params=None):
+        """Sends a request and returns the parsed JSON response"""
+        retries = 0
+        while True:
+            await self._acquire()
+            try:
+                response = await self.session.request(method, path, params=params)
+            except httpx.TransportError as error:
+                response, exception = None, error
+            finally:
+                self._slots.release()
+            if response is not None:
+                if response.status_code < 400:
+                    return response.json()
+                exception = asana_error(response)
+                if not isinstance(exception, RetryableAsanaError):
+                    raise exception
+            if retries >= self.MAX_RETRIES:
+                raise exception
+            if isinstance(exception, RateLimitEnforcedError):
+                retry_after = exception.retry_after or self.RETRY_DELAY
+                logger.warning(
+                    "Rate limited for %s, %s; waiting %s seconds",
+                    method,
+                    path,
+                    retry_after,
+                )
+                if self.rate_limiter:
+                    self.rate_limiter.throttle(retry_after)
+                else:
+                    await asyncio.sleep(retry_after)
+            else:
+                logger.error("Error for %s, %s: %s", method, path, exception)
+                await asyncio.sleep(self.RETRY_DELAY * (self.RETRY_BACKOFF ** retries))
+            retries += 1
+
+    @staticmethod
+    def _params(params=None, fields=None):
+        params = dict(params or {})
+        if fields:
+            params["opt_fields"] = ",".join(fields)
+        return params
+
+    async def get(self, path, params=None, fields=None):
+        """Returns the data of a single record"""
+        result = await self.request("GET", path, self._params(params, fields))
+        return result["data"]
+
+    async def get_pages(self, path, params=None, fields=None):
+        """Yields (offset, records) for each page of a collection, PAGE_SIZE long
+
+        The first page is read from params["offset"], if it is given.
+        """
+        params = self._params(params, fields)
+        params["limit"] = PAGE_SIZE
+        while True:
+            result = await self.request("GET", path, params)
+            yield params.get("offset"), result.get("data") or []
+            next_page = result.get("next_page")
+            if not next_page:
+                return
+            params["offset"] = next_page["offset"]
+
+    async def get_collection(self, path, params=None, fields=None):
+        """Yields the records of a collection, reading PAGE_SIZE at a time"""
+        async for _, records in self.get_pages(path, params, fields):
+            for record in records:
+                yield record
+
+
+def async_client_connect(**kwargs):
+    """Returns an AsyncClient for the ASANA_ACCESS_TOKEN setting
+
+    It paces its requests with the RateLimiter of the clients of client_connect.
+    """
+    if not getattr(settings, "ASANA_ACCESS_TOKEN", None):
+        raise ImproperlyConfigured(
+            "It is required to set ASANA_ACCESS_TOKEN to sync asynchronously."
+        )
+    return AsyncClient(
+        settings.ASANA_ACCESS_TOKEN,
+        rate_limiter=_shared_rate_limiter(_settings_key()),
+        max_connections=getattr(settings, "ASANA_MAX_CONCURRENT_REQUESTS", 50),
+        **kwargs,
+    )
@@ -0,0 +1,66 @@
+"""A per-run cache of the custom field definitions of Asana workspaces"""
+from django.core.cache import cache
+
+from djasana.models import CustomField
+from djasana.settings import settings
+from djasana.utils import get_opt_fields
+
+CACHE_KEY = "djasana:custom_fields:{}"
+
+
+class CustomFieldCache(object):
+    """Holds the custom field definitions of the workspaces a sync reads.
+
+    The first time a field of a workspace is needed, all the custom fields of that
+    workspace are read with one paged listing, and kept for the rest of the run.
+    They are also put in Django's cache for timeout seconds, so runs started within
+    that time skip the listing. A timeout of 0 keeps them for this run only.
+
+    Fields created after the listing are read one by one, as they are met.
+    """
+
+    def __init__(self, client, timeout=None):
+        self.client = client
+        if timeout is None:
+            timeout = settings.DJASANA_CUSTOM_FIELD_CACHE_TIMEOUT
+        self.timeout = timeout
+        self._workspaces = {}
+        self.written = set()
+
+    def get(self, workspace_id, remote_id):
+        """Returns a copy of the definition of a custom field"""
+        definitions = self._definitions(str(workspace_id))
+        remote_id = str(remote_id)
+        if remote_id not in definitions:
+            definitions[remote_id] = self.client.custom_fields.find_by_id(
+                remote_id, fields=get_opt_fields(CustomField)
+            )
+            self._store(str(workspace_id))
+        return dict(definitions[remote_id])
+
+    def _definitions(self, workspace_id):
+        if workspace_id in self._workspaces:
+            return self._workspaces[workspace_id]
+        definitions = None
+        if self.timeout:
+            definitions = cache.get(CACHE_KEY.format(workspace_id))
+        listed = definitions is None
+        if listed:
+            definitions = {
+                record["gid"]: record
+                for record in self.client.custom_fields.find_by_workspace(
+                    workspace_id, fields=get_opt_fields(CustomField)
+                )
+            }
+        self._workspaces[workspace_id] = definitions
+        if listed:
+            self._store(workspace_id)
+        return definitions
+
+    def _store(self, workspace_id):
+        if self.timeout:
+            cache.set(
+                CACHE_KEY.format(workspace_id),
+                self._workspaces[workspace_id],
+                self.timeout,
+            )
@@ -0,0 +1,64 @@
+"""A bounded, per-run map of Asana remote ids to local primary keys"""
+from collections import OrderedDict
+
+from djasana.models import Project, Tag, Team, User
+
+
+class IdentityMap(object):
+    """Maps remote_id to primary key for the objects a sync refers to over and over.
+
+    Each model keeps at most maxsize entries and evicts the least recently used one
+    when it grows past that. A primary key of None means the row is known to exist
+    but its pk has not been read.
+    """
+
+    def __init__(self, models=(Project, Tag, Team, User), maxsize=50000):
+        self.maxsize = maxsize
+        self._maps = {model: OrderedDict() for model in models}
+        self.hits = 0
+        self.misses = 0
+
+    def prefill(self, using="default"):
+        """Loads up to maxsize rows of each model, with one query per model"""
+        for model, entries in self._maps.items():
+            rows = (
+                model._default_manager.using(using)
+                .exclude(remote_id__isnull=True)
+                .values_list("remote_id", "pk")[: self.maxsize]
+            )
+            entries.update(rows.iterator())
+
+    def known(self, model, remote_id):
+        """Returns True if a row of model with remote_id is known to exist"""
+        entries = self._maps.get(model)
+        if entries is None:
+            return False
+        remote_id = int(remote_id)
+        if remote_id in entries:
+            entries.move_to_end(remote_id)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get(self, model, remote_id):
+        """Returns the primary key of the row with remote_id, or None if not known"""
+        if self.known(model, remote_id):
+            return self._maps[model][int(remote_id)]
+        return None
+
+    def add(self, model, remote_id, pk=None):
+        entries = self._maps.get(model)
+        if entries is None:
+            return
+        remote_id = int(remote_id)
+        if pk is not None or entries.get(remote_id) is None:
+            entries[remote_id] = pk
+        entries.move_to_end(remote_id)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def discard(self, model, remote_id):
+        entries = self._maps.get(model)
+        if entries is not None:
+            entries.pop(int(remote_id), None)
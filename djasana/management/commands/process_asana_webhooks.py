@@ -0,0 +1,135 @@
+"""The django management command process_asana_webhooks"""
+import json
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from djasana.models import WebhookDelivery
+from djasana.views import process_delivery
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Process the webhook deliveries waiting in the inbox"""
+
+    help = (
+        "Process the webhook payloads from Asana that WebhookView stored in the "
+        "inbox. Several of these commands can run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10,
+            help="Claim this many deliveries at a time.",
+        )
+        parser.add_argument(
+            "--lease",
+            type=float,
+            default=300,
+            help="Seconds a claim lasts. Deliveries a worker claimed and did not "
+                 "finish in that time, for example because it stopped, are "
+                 "claimed again.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Give up on a delivery after it failed this many times. "
+                 "It is kept in the inbox, with its last error.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep waiting for new deliveries instead of exiting when the "
+                 "inbox is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="With --loop, seconds to wait when the inbox is empty.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = self.drain(
+                max(options["batch_size"], 1),
+                options["max_attempts"],
+                timedelta(seconds=options["lease"]),
+            )
+            if processed or failed:
+                message = "Processed {} webhook deliveries; {} failed.".format(
+                    processed, failed
+                )
+                if options["verbosity"] >= 1:
+                    self.stdout.write(message)
+                logger.info(message)
+            if not options["loop"]:
+                break
+            if not processed:
+                time.sleep(options["interval"])
+
+    @staticmethod
+    def drain(batch_size, max_attempts, lease=timedelta(minutes=5)):
+        """Processes deliveries until none are left to claim.
+
+        A batch is claimed by stamping its claimed_at in a short transaction, with
+        SELECT ... FOR UPDATE SKIP LOCKED so other workers pass over it, and the
+        inbox rows are not locked after that. Each delivery is then processed in a
+        transaction of its own, which stays open while the delivery's resources are
+        read from Asana. The events of a delivery that succeed are
+        kept; the delivery stays in the inbox with only the events that failed and
+        their errors, and is not tried again in this call. Returns the numbers
+        processed and failed.
+        """
+        processed = 0
+        failed = []
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                deliveries = list(
+                    WebhookDelivery.objects.select_for_update(skip_locked=True)
+                    .filter(attempts__lt=max_attempts)
+                    .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - lease))
+                    .exclude(pk__in=failed)
+                    .order_by("pk")[:batch_size]
+                )
+                WebhookDelivery.objects.filter(
+                    pk__in=[delivery.pk for delivery in deliveries]
+                ).update(claimed_at=now)
+            if not deliveries:
+                return processed, len(failed)
+            for delivery in deliveries:
+                try:
+                    with transaction.atomic():
+                        failures = process_delivery(delivery)
+                        if not failures:
+                            delivery.delete()
+                except Exception:
+                    logger.exception("Error processing delivery %s", delivery.pk)
+                    failures = None
+                    delivery.error = traceback.format_exc()
+                if failures is None or failures:
+                    if failures:
+                        # Keep only the events to try again.
+                        delivery.payload = json.dumps(
+                            {"events": [event for event, _ in failures]}
+                        )
+                        delivery.error = "\n".join(error for _, error in failures)
+                    delivery.attempts += 1
+                    delivery.claimed_at = None
+                    delivery.save(
+                        update_fields=["attempts", "claimed_at", "error", "payload"]
+                    )
+                    failed.append(delivery.pk)
+                else:
+                    processed += 1
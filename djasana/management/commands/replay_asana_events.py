@@ -0,0 +1,83 @@
+"""The django management command replay_asana_events"""
+import logging
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from djasana.events import apply_event, decompress, resource_type
+from djasana.management.commands.sync_from_asana import since
+from djasana.models import Event, Project
+from djasana.views import process_events
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Re-apply logged Asana events to the local data"""
+
+    help = (
+        "Re-apply the events logged in a time range to the local data. Events that "
+        "carry everything they change are applied from the log; the resources of "
+        "the others are read from Asana again, unless --offline is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=since,
+            help="Replay events that happened at or after this ISO 8601 date or "
+                 "datetime.",
+        )
+        parser.add_argument(
+            "--until",
+            type=since,
+            help="Replay events that happened before this ISO 8601 date or datetime.",
+        )
+        parser.add_argument(
+            "-p",
+            "--project",
+            action="append",
+            default=[],
+            help="Replay only the events of the project with this gid (can be used "
+                 "multiple times).",
+        )
+        parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="Do not contact Asana; skip events that need their resource read.",
+        )
+
+    def handle(self, *args, **options):
+        events = Event.objects.order_by("pk")
+        if options["since"]:
+            events = events.filter(created_at__gte=options["since"])
+        if options["until"]:
+            events = events.filter(created_at__lt=options["until"])
+        if options["project"]:
+            events = events.filter(project_id__in=options["project"])
+        applied = 0
+        pending = defaultdict(list)
+        for logged in events.iterator():
+            event = decompress(logged.payload)
+            if apply_event(event):
+                applied += 1
+                continue
+            # The webhook processing reads the type from the resource.
+            event["resource"].setdefault("resource_type", resource_type(event))
+            pending[logged.project_id].append(event)
+        fetched = skipped = failed = 0
+        for project_id, events_ in pending.items():
+            project = Project.objects.filter(remote_id=project_id).first()
+            if options["offline"] or project is None:
+                skipped += len(events_)
+                continue
+            failures = process_events(events_, project, record=False)
+            fetched += len(events_) - len(failures)
+            failed += len(failures)
+        message = (
+            "Applied {} events from the log, {} by reading from Asana; "
+            "skipped {}, failed {}.".format(applied, fetched, skipped, failed)
+        )
+        if options["verbosity"] >= 1:
+            self.stdout.write(message)
+        logger.info(message)
@@ -1,11 +1,33 @@
 """The django management command sync_from_asana"""
+import argparse
+import datetime
 import logging, traceback
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from djasana.async_synchronizer import AsyncAsanaSynchronizer
 from djasana.synchronizer import AsanaSynchronizer
 
 logger = logging.getLogger(__name__)
 
 
+def since(value):
+    """Parses the --since option: an ISO 8601 date or datetime"""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            date = parse_date(value)
+            if date is not None:
+                moment = datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise argparse.ArgumentTypeError(f"Not an ISO 8601 date or datetime: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
 class Command(BaseCommand):
     """Sync data from Asana to the database"""
 
@@ -71,6 +93,53 @@ class Command(BaseCommand):
             default=True,
             help="Will not commit changes to the database.",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="Fetch tasks from Asana with this many concurrent requests. "
+                 "Database writes still happen in a single thread.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Write synced objects to the database in batches of this size.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Split the projects of each workspace across this many worker "
+                 "processes, balanced by their number of tasks.",
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_async",
+            help="Read tasks from Asana with asyncio, keeping many requests in "
+                 "flight. Requires httpx. With --jobs, that many tasks are read at a "
+                 "time; the default is 50.",
+        )
+        parser.add_argument(
+            "--since",
+            type=since,
+            help="Sync only tasks modified after this ISO 8601 date or datetime, "
+                 "found with a workspace-wide task search.",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Sync only tasks modified since the last successful incremental sync "
+                 "of each workspace. The first run is a full sync.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Resume an interrupted sync, skipping the projects it finished and "
+                 "starting the others from the last page of tasks it wrote.",
+        )
 
     def handle(self, *args, **options):
         self.commit = not options.get("nocommit")
@@ -89,7 +158,14 @@ class Command(BaseCommand):
         workspaces = options.get("workspace") or []
         projects = options.get("project")
 
-        synchronizer = AsanaSynchronizer(
+        synchronizer_class = AsanaSynchronizer
+        synchronizer_kwargs = {"max_workers": options.get("jobs") or 1}
+        if options.get("use_async"):
+            synchronizer_class = AsyncAsanaSynchronizer
+            synchronizer_kwargs = {}
+            if (options.get("jobs") or 1) > 1:
+                synchronizer_kwargs["max_tasks"] = options["jobs"]
+        synchronizer = synchronizer_class(
             commit=self.commit,
             workspaces=workspaces,
             projects=projects,
@@ -97,6 +173,12 @@ class Command(BaseCommand):
             exclude_models=options.get("model_exclude"),
             include_models=options.get("model"),
             process_archived=options.get("archive"),
+            batch_size=options.get("batch_size") or 500,
+            since=options.get("since"),
+            incremental=options.get("incremental", False),
+            processes=options.get("processes") or 1,
+            resume=options.get("resume", False),
+            **synchronizer_kwargs,
         )
         try:
             synchronizer.run_sync()
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0029_alter_customfield_enum_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('synced_at', models.DateTimeField(help_text='When the last successful sync of the workspace started')),
+                ('workspace', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='djasana.workspace', to_field='remote_id')),
+            ],
+        ),
+    ]
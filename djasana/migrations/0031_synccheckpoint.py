@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-17 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0030_syncmark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finished', models.BooleanField(default=False, help_text='Whether the project was synced completely')),
+                ('offset', models.CharField(blank=True, help_text='Offset of the page of tasks the sync is to resume from', max_length=1024, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='djasana.project', to_field='remote_id')),
+            ],
+        ),
+    ]
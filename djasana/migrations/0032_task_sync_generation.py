@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0031_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synccheckpoint',
+            name='generation',
+            field=models.PositiveIntegerField(blank=True, help_text='The sync run the checkpoint belongs to', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='sync_generation',
+            field=models.PositiveIntegerField(blank=True, db_index=True, help_text='The sync run that last wrote this task', null=True),
+        ),
+    ]
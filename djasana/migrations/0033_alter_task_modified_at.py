@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0032_task_sync_generation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='modified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
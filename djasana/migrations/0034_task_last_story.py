@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0033_alter_task_modified_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='last_story_at',
+            field=models.DateTimeField(blank=True, help_text='When the newest story synced was created', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='last_story_offset',
+            field=models.CharField(blank=True, help_text='Offset of the page of stories holding the newest story synced', max_length=1024, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0034_task_last_story'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text='How many times processing the payload failed')),
+                ('error', models.TextField(blank=True, help_text='The error of the last failed attempt', null=True)),
+                ('payload', models.TextField(help_text='The body of the request, as received')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djasana.project', to_field='remote_id')),
+            ],
+            options={
+                'verbose_name_plural': 'webhook deliveries',
+            },
+        ),
+    ]
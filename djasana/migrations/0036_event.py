@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0035_webhookdelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=24)),
+                ('created_at', models.DateTimeField(db_index=True, help_text='When the event happened in Asana')),
+                ('gid', models.CharField(blank=True, help_text='The gid of the resource', max_length=31, null=True)),
+                ('logged_at', models.DateTimeField(auto_now_add=True)),
+                ('payload', models.BinaryField()),
+                ('resource_type', models.CharField(blank=True, max_length=24, null=True)),
+                ('project', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='djasana.project', to_field='remote_id')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0036_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookdelivery',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When a worker claimed the delivery for processing', null=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookdelivery',
+            name='payload',
+            field=models.TextField(help_text='The body of the request, or the events that failed to process'),
+        ),
+    ]
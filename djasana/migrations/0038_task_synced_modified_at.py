@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djasana', '0037_webhookdelivery_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='synced_modified_at',
+            field=models.DateTimeField(blank=True, help_text='The modified_at of the task when a sync last wrote it with its attachments and stories', null=True),
+        ),
+    ]
@@ -194,6 +194,36 @@ class CustomFieldSetting(BaseModel):
     )
 
 
+class Event(models.Model):
+    """An event Asana sent about a project, kept as it was received.
+
+    Events are only ever appended, by the synchronizer and WebhookView, and are
+    read back by the replay_asana_events command. The event itself is kept as
+    zlib compressed JSON; see djasana.events.
+    """
+
+    action = models.CharField(max_length=24)
+    created_at = models.DateTimeField(
+        db_index=True, help_text="When the event happened in Asana"
+    )
+    gid = models.CharField(
+        max_length=31, null=True, blank=True, help_text="The gid of the resource"
+    )
+    logged_at = models.DateTimeField(auto_now_add=True)
+    payload = models.BinaryField()
+    project = models.ForeignKey(
+        "Project",
+        to_field="remote_id",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    resource_type = models.CharField(max_length=24, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.resource_type} {self.gid} {self.action}"
+
+
 class Project(NamedModel):
     """An Asana project in a workspace having a collection of tasks."""
 
@@ -370,6 +400,44 @@ class Story(Hearted, NamedModel):
         verbose_name_plural = "stories"
 
 
+class SyncCheckpoint(models.Model):
+    """How far a full sync of the project got, for resuming an interrupted run"""
+
+    finished = models.BooleanField(
+        default=False, help_text="Whether the project was synced completely"
+    )
+    generation = models.PositiveIntegerField(
+        null=True, blank=True, help_text="The sync run the checkpoint belongs to"
+    )
+    offset = models.CharField(
+        max_length=1024,
+        null=True,
+        blank=True,
+        help_text="Offset of the page of tasks the sync is to resume from",
+    )
+    project = models.OneToOneField(
+        "Project", to_field="remote_id", on_delete=models.CASCADE
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.project_id} {'finished' if self.finished else self.offset}"
+
+
+class SyncMark(models.Model):
+    """The high-water mark of the last successful incremental sync of a workspace"""
+
+    synced_at = models.DateTimeField(
+        help_text="When the last successful sync of the workspace started"
+    )
+    workspace = models.OneToOneField(
+        "Workspace", to_field="remote_id", on_delete=models.CASCADE
+    )
+
+    def __str__(self):
+        return f"{self.workspace_id} @ {self.synced_at.isoformat()}"
+
+
 class SyncToken(models.Model):
     """The most recent sync token received from Asana for the project"""
 
@@ -433,7 +501,16 @@ class Task(Hearted, NamedModel):
     due_on = models.DateField(null=True, blank=True)
     followers = models.ManyToManyField("User", related_name="tasks_following")
     html_notes = models.TextField(null=True, blank=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    last_story_at = models.DateTimeField(
+        null=True, blank=True, help_text="When the newest story synced was created"
+    )
+    last_story_offset = models.CharField(
+        max_length=1024,
+        null=True,
+        blank=True,
+        help_text="Offset of the page of stories holding the newest story synced",
+    )
+    modified_at = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
     parent = models.ForeignKey(
         "self", to_field="remote_id", null=True, blank=True, on_delete=models.SET_NULL
@@ -446,6 +523,18 @@ class Task(Hearted, NamedModel):
         max_length=24, null=True, blank=True, default="task"
     )
     start_on = models.DateField(null=True, blank=True)
+    sync_generation = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="The sync run that last wrote this task",
+    )
+    synced_modified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="The modified_at of the task when a sync last wrote it with its "
+        "attachments and stories",
+    )
     tags = models.ManyToManyField("Tag")
 
     def _asana_project_url(self, project):
@@ -609,6 +698,40 @@ class Webhook(models.Model):
     )
 
 
+class WebhookDelivery(models.Model):
+    """A verified webhook payload from Asana, waiting to be processed.
+
+    Filled by WebhookView when DJASANA_WEBHOOK_INBOX is set and drained by the
+    process_asana_webhooks command.
+    """
+
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text="How many times processing the payload failed"
+    )
+    claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="When a worker claimed the delivery for processing",
+    )
+    error = models.TextField(
+        null=True, blank=True, help_text="The error of the last failed attempt"
+    )
+    payload = models.TextField(
+        help_text="The body of the request, or the events that failed to process"
+    )
+    project = models.ForeignKey(
+        "Project", to_field="remote_id", on_delete=models.CASCADE
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "webhook deliveries"
+
+    def __str__(self):
+        return f"{self.project_id} {self.received_at}"
+
+
 class Workspace(NamedModel):
     """An object for grouping projects"""
 
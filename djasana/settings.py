@@ -4,4 +4,11 @@ settings.DJASANA_WEBHOOK_URL = getattr(settings, "DJASANA_WEBHOOK_URL", None)
 settings.DJASANA_WEBHOOK_PATTERN = getattr(
     settings, "DJASANA_WEBHOOK_PATTERN", r"^djasana/webhooks/"
 )
+settings.DJASANA_WEBHOOK_INBOX = getattr(settings, "DJASANA_WEBHOOK_INBOX", False)
+settings.DJASANA_WEBHOOK_SECRET_CACHE_TIMEOUT = getattr(
+    settings, "DJASANA_WEBHOOK_SECRET_CACHE_TIMEOUT", 300
+)
 settings.ASANA_WORKSPACE = getattr(settings, "ASANA_WORKSPACE", None)
+settings.DJASANA_CUSTOM_FIELD_CACHE_TIMEOUT = getattr(
+    settings, "DJASANA_CUSTOM_FIELD_CACHE_TIMEOUT", 600
+)
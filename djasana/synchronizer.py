@@ -2,17 +2,42 @@ from __future__ import unicode_literals
 
 __author__ = 'David Baum'
 
-import logging, time
+import heapq
+import logging
+import multiprocessing
+import time
+import traceback
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 
-from asana.error import NotFoundError, InvalidTokenError, ForbiddenError
+from asana.error import (
+    ForbiddenError,
+    InvalidRequestError,
+    InvalidTokenError,
+    NotFoundError,
+    PremiumOnlyError,
+)
+import django
 from django.apps import apps
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from requests.adapters import HTTPAdapter
 from django.core.management.base import OutputWrapper
-from djasana.connect import client_connect
+from djasana.bulk import BulkWriter
+from djasana.connect import Batch, client_connect, get_resolver
+from djasana.custom_fields import CustomFieldCache
+from djasana.events import log_events
+from djasana.identity import IdentityMap
 from djasana.settings import settings
 from djasana.models import (
     Attachment,
     Project,
     Story,
+    SyncCheckpoint,
+    SyncMark,
     SyncToken,
     Tag,
     Task,
@@ -22,6 +47,10 @@ from djasana.models import (
     Workspace,
 )
 from djasana.utils import (
+    coalesce_events,
+    forget_webhook_secret,
+    get_opt_fields,
+    is_complete,
     pop_unsupported_fields,
     set_webhook,
     sync_attachment,
@@ -34,6 +63,94 @@ from typing import Union, List
 
 logger = logging.getLogger(__name__)
 
+# Task search returns a single page of at most this many tasks.
+SEARCH_PAGE_SIZE = 100
+# Stale tasks are deleted this many at a time.
+DELETE_BATCH_SIZE = 500
+# Tasks are looked up and linked to their parents this many at a time.
+LINK_BATCH_SIZE = 500
+
+
+class IncompleteSearch(Exception):
+    """Task search cannot page past a full page of tasks modified at one time"""
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items of iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def as_datetime(value):
+    """Returns a datetime from Asana, which may still be an ISO 8601 string"""
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
+def with_offsets(items):
+    """Yields (offset of its page, item) for the items of a paginated collection"""
+    for item in items:
+        yield getattr(items, "offset", None), item
+
+
+def newer_stories(stories, watermark=None):
+    """Picks the stories created from the watermark on, out of the stories of a task
+
+    stories are (page offset, story) pairs, in the order Asana lists them, which
+    is oldest first. A watermark is the offset of the page holding the newest story
+    seen, and when that story was created. Returns the stories picked and the new
+    watermark. The story at the watermark itself is picked again, as are stories
+    created in the same millisecond; writing them is a no-op.
+    """
+    offset, seen_at = watermark or (None, None)
+    newest_at = seen_at
+    picked = []
+    for page_offset, story in stories:
+        created_at = as_datetime(story.get("created_at"))
+        if seen_at is None or created_at is None or created_at >= seen_at:
+            picked.append(story)
+        offset = page_offset
+        if created_at is not None and (newest_at is None or created_at > newest_at):
+            newest_at = created_at
+    return picked, (offset, newest_at)
+
+
+def shard_projects(project_ids, sizes, shards):
+    """Splits project_ids into at most shards lists of about the same total size
+
+    Projects are dealt largest first to the lightest shard. Projects without a
+    size are taken to be of average size.
+    """
+    known = [sizes[project_id] for project_id in project_ids if project_id in sizes]
+    default_size = sum(known) / len(known) if known else 1
+    heap = [(0, index, []) for index in range(min(shards, len(project_ids)))]
+    for project_id in sorted(
+            project_ids, key=lambda id_: sizes.get(id_, default_size), reverse=True
+    ):
+        load, index, shard = heapq.heappop(heap)
+        shard.append(project_id)
+        # Count every project as at least one, so empty projects are spread too.
+        load += max(sizes.get(project_id, default_size), 1)
+        heapq.heappush(heap, (load, index, shard))
+    return [shard for _, _, shard in sorted(heap, key=lambda item: item[1]) if shard]
+
+
+def sync_project_shard(synchronizer_class, options, workspace_id, project_ids):
+    """Syncs some projects of a workspace, in a worker process; returns its stats
+
+    The worker has its own database connection and Asana client.
+    """
+    synchronizer = synchronizer_class(**dict(options, workspaces=[workspace_id]))
+    try:
+        return synchronizer.sync_projects(workspace_id, project_ids)
+    finally:
+        synchronizer.close()
+
 
 class AsanaSynchronizer(object):
     def __init__(
@@ -47,8 +164,39 @@ class AsanaSynchronizer(object):
             projects: List[str] = [],
             stdout: Union[OutputWrapper, None] = None,
             app_logger: Union[logging.Logger, None] = None,
+            max_workers: int = 1,
+            batch_size: int = 500,
+            identity_map_size: int = 50000,
+            since: Union[datetime, None] = None,
+            incremental: bool = False,
+            processes: int = 1,
+            resume: bool = False,
+            generation: Union[int, None] = None,
     ):
-        self.synced_ids = []
+        # What worker processes need to build a synchronizer like this one.
+        self.options = {
+            "commit": commit,
+            "process_archived": process_archived,
+            "exclude_models": exclude_models,
+            "include_models": include_models,
+            "projects": projects,
+            "max_workers": max_workers,
+            "batch_size": batch_size,
+            "identity_map_size": identity_map_size,
+            "since": since,
+            "incremental": incremental,
+            "resume": resume,
+            "generation": generation,
+        }
+        self.processes = max(processes or 1, 1)
+        self.stats = Counter()
+        self.errors = []
+        self.synced_ids = set()
+        self._webhook_project_ids = []
+        self.since = since
+        self.incremental = incremental
+        self.resume = resume
+        self.generation = generation
         self.commit = commit
         self.stdout = stdout
         self.process_archived = process_archived
@@ -64,13 +212,66 @@ class AsanaSynchronizer(object):
         self.workspaces = workspaces
         if settings.ASANA_WORKSPACE:
             workspaces.append(settings.ASANA_WORKSPACE)
-        self.client = client_connect()
+        # A client of its own, as the sync sets its connection pool and workspace.
+        self.client = client_connect(pooled=False)
+        self.resolver = get_resolver(self.client)
+        self.custom_fields = CustomFieldCache(self.client)
+        self.identity = IdentityMap(maxsize=identity_map_size)
+        self.writer = BulkWriter(batch_size=batch_size, identity=self.identity)
+        self.max_workers = max(max_workers or 1, 1)
+        self._executor = None
+        if self.max_workers > 1:
+            # Let every worker keep its own connection alive.
+            self.client.session.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=self.max_workers, pool_maxsize=self.max_workers
+                ),
+            )
         self.workspace_ids = self._get_workspace_ids(workspaces)
         self.projects = projects
 
     def run_sync(self):
-        for workspace_id in self.workspace_ids:
-            self._sync_workspace_id(workspace_id, self.projects, self.process_models)
+        if self.commit:
+            self.identity.prefill()
+            self._start_generation()
+        try:
+            for workspace_id in self.workspace_ids:
+                self._sync_workspace_id(
+                    workspace_id, self.projects, self.process_models
+                )
+        finally:
+            self.close()
+        if self.commit:
+            # The run is complete, so there is nothing left to resume.
+            SyncCheckpoint.objects.filter(generation=self.generation).delete()
+        if self.stats["tasks_fetched"] or self.stats["tasks_unchanged"]:
+            message = "Read {} tasks from Asana; skipped {} unchanged tasks.".format(
+                self.stats["tasks_fetched"], self.stats["tasks_unchanged"]
+            )
+            if self.stdout:
+                self.stdout.write(message)
+            self.logger.info(message)
+        if self.client.rate_limiter:
+            self.logger.info("Asana rate limiter: %s", self.client.rate_limiter.stats)
+        self.logger.debug(
+            "Identity map: %s hits, %s misses", self.identity.hits, self.identity.misses
+        )
+
+    def close(self):
+        """Shuts down the worker pool, if one was started"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def executor(self):
+        """The pool that fetches task data from Asana when max_workers > 1"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="djasana"
+            )
+        return self._executor
 
     def _sync_workspace_id(self, workspace_id, projects, models):
         workspace_dict = self.client.workspaces.find_by_id(workspace_id)
@@ -84,6 +285,25 @@ class AsanaSynchronizer(object):
             )[0]
         else:
             workspace = None
+        started_at = timezone.now()
+        since = self._get_since(workspace_id)
+        if since is not None:
+            try:
+                self._sync_modified_tasks(workspace_id, since, models)
+            except PremiumOnlyError:
+                self.logger.warning(
+                    "Task search is not available in workspace %s; syncing it in full",
+                    workspace_dict["name"],
+                )
+            except IncompleteSearch as error:
+                self.logger.warning(
+                    "%s in workspace %s; syncing it in full",
+                    error,
+                    workspace_dict["name"],
+                )
+            else:
+                self._set_sync_mark(workspace_dict, started_at)
+                return
         project_ids = self._get_project_ids(projects, workspace_id)
         if (
                 "workspace_id" in self.client.options
@@ -92,23 +312,32 @@ class AsanaSynchronizer(object):
             self.client.options["workspace_id"] = str(workspace_id)
 
         if User in models:
-            for user in self.client.users.find_all({"workspace": workspace_id}):
+            for user in self.client.users.find_all(
+                    {"workspace": workspace_id}, fields=get_opt_fields(User)
+            ):
                 self._sync_user(user, workspace)
-                time.sleep(0.5)
 
         if Tag in models:
-            for tag in self.client.tags.find_by_workspace(workspace_id):
+            for tag in self.client.tags.find_by_workspace(
+                    workspace_id, fields=get_opt_fields(Tag)
+            ):
                 self._sync_tag(tag, workspace)
-                time.sleep(0.5)
 
         if Team in models:
-            for team in self.client.teams.find_by_organization(workspace_id):
+            for team in self.client.teams.find_by_organization(
+                    workspace_id, fields=get_opt_fields(Team)
+            ):
                 self._sync_team(team)
-                time.sleep(0.5)
 
+        self.writer.flush()
         if Project in models:
-            for project_id in project_ids:
-                self._check_sync_project_id(project_id, workspace, models)
+            if self.processes > 1 and len(project_ids) > 1:
+                self._sync_project_shards(workspace_id, project_ids)
+            else:
+                for project_id in project_ids:
+                    self._check_sync_project_id(project_id, workspace, models)
+                self._reconcile_webhooks(workspace_id)
+        self._set_sync_mark(workspace_dict, started_at)
 
         if workspace:
             message = f"Successfully synced workspace {workspace.name}."
@@ -116,9 +345,203 @@ class AsanaSynchronizer(object):
                 self.stdout.write(self.style.SUCCESS(message))
             self.logger.info(message)
 
+    def _start_generation(self):
+        """Picks the generation number stamped on every task this run writes
+
+        A resumed run carries on with the generation of the run it resumes, so
+        that the tasks that run wrote are not taken for stale ones.
+        """
+        if self.generation is None and self.resume:
+            self.generation = SyncCheckpoint.objects.aggregate(Max("generation"))[
+                "generation__max"
+            ]
+        if self.generation is None:
+            latest = Task.objects.aggregate(Max("sync_generation"))[
+                "sync_generation__max"
+            ]
+            self.generation = (latest or 0) + 1
+        self.options["generation"] = self.generation
+
+    def sync_projects(self, workspace_id, project_ids):
+        """Syncs these projects of a workspace and returns stats of the work done
+
+        An error syncing one project is recorded and does not stop the others.
+        """
+        started = time.monotonic()
+        if self.commit:
+            self.identity.prefill()
+            self._start_generation()
+        workspace = Workspace.objects.filter(remote_id=workspace_id).first()
+        for project_id in project_ids:
+            try:
+                self._check_sync_project_id(project_id, workspace, self.process_models)
+            except Exception:
+                self.errors.append((project_id, traceback.format_exc()))
+                self.logger.error("Error syncing project %s", project_id)
+            else:
+                self.stats["projects"] += 1
+        self.writer.flush()
+        self._reconcile_webhooks(workspace_id)
+        self.stats["tasks"] += len(self.synced_ids)
+        self.stats["seconds"] += time.monotonic() - started
+        return {"stats": dict(self.stats), "errors": self.errors}
+
+    def _sync_project_shards(self, workspace_id, project_ids):
+        """Splits the projects over worker processes and merges what they report"""
+        sizes = dict(
+            Project.objects.filter(remote_id__in=project_ids)
+            .annotate(num_tasks=Count("task"))
+            .values_list("remote_id", "num_tasks")
+        )
+        shards = shard_projects(project_ids, sizes, self.processes)
+        self.logger.info(
+            "Syncing %s projects in %s processes", len(project_ids), len(shards)
+        )
+        stats = Counter()
+        errors = []
+        with ProcessPoolExecutor(
+                max_workers=len(shards),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+        ) as executor:
+            futures = [
+                executor.submit(
+                    sync_project_shard, type(self), self.options, workspace_id, shard
+                )
+                for shard in shards
+            ]
+            for shard, future in zip(shards, futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    errors.append((shard, traceback.format_exc()))
+                else:
+                    stats.update(result["stats"])
+                    errors.extend(result["errors"])
+        self.stats.update(stats)
+        self.errors.extend(errors)
+        message = "Synced {} projects and {} tasks in {} processes.".format(
+            stats["projects"], stats["tasks"], len(shards)
+        )
+        if errors:
+            message += " {} errors.".format(len(errors))
+        if self.stdout:
+            self.stdout.write(message)
+        self.logger.info(message)
+        for project_ids_, error in errors:
+            self.logger.error("Error syncing %s: %s", project_ids_, error)
+        if errors:
+            raise RuntimeError(
+                "Errors syncing projects {}".format(
+                    ", ".join(str(project_ids_) for project_ids_, _ in errors)
+                )
+            )
+
+    def _get_since(self, workspace_id):
+        """Returns the time after which modified tasks are to be synced, if any"""
+        if self.since:
+            return self.since
+        if self.incremental:
+            mark = SyncMark.objects.filter(workspace_id=workspace_id).first()
+            if mark:
+                return mark.synced_at
+        return None
+
+    def _set_sync_mark(self, workspace_dict, synced_at):
+        """Records the start of this run as the high-water mark of the workspace"""
+        if not (self.incremental and self.commit):
+            return
+        self.writer.flush()
+        Workspace.objects.get_or_create(
+            remote_id=workspace_dict["gid"], defaults={"name": workspace_dict["name"]}
+        )
+        SyncMark.objects.update_or_create(
+            workspace_id=workspace_dict["gid"], defaults={"synced_at": synced_at}
+        )
+
+    def _sync_modified_tasks(self, workspace_id, since, models):
+        """Syncs the tasks of a workspace modified after since, whatever their project
+
+        Tasks deleted from Asana are not found this way; a full sync removes them.
+        """
+        if Task not in models:
+            return
+        synced_count = len(self.synced_ids)
+        self._sync_tasks(
+            self._search_modified_tasks(workspace_id, since), None, models
+        )
+        self.writer.flush()
+        message = "Synced {} tasks modified since {}.".format(
+            len(self.synced_ids) - synced_count, since.isoformat()
+        )
+        if self.stdout:
+            self.stdout.write(message)
+        self.logger.info(message)
+
+    def _search_modified_tasks(self, workspace_id, since):
+        """Yields the tasks of a workspace modified after since, least recent first
+
+        Task search returns a single page, so the search is repeated from the
+        modified_at of the last task found until a page comes back short. A full
+        page that brings no new tasks, as after a bulk edit of more tasks than fit
+        on a page, raises IncompleteSearch, as the tasks after it cannot be reached.
+        """
+        seen = set()
+        after = since
+        while True:
+            page = list(
+                self.client.tasks.search_in_workspace(
+                    workspace_id,
+                    {
+                        "modified_at.after": after.isoformat(),
+                        "sort_by": "modified_at",
+                        "sort_ascending": True,
+                    },
+                    fields=get_opt_fields(Task),
+                    page_size=SEARCH_PAGE_SIZE,
+                )
+            )
+            new_tasks = [task for task in page if task["gid"] not in seen]
+            for task in new_tasks:
+                seen.add(task["gid"])
+                yield task
+            if len(page) < SEARCH_PAGE_SIZE:
+                return
+            last_modified_at = parse_datetime(page[-1].get("modified_at") or "")
+            if not new_tasks or last_modified_at is None:
+                raise IncompleteSearch(
+                    "More than {} tasks were modified at {}".format(
+                        SEARCH_PAGE_SIZE, page[-1].get("modified_at")
+                    )
+                )
+            # Search again from just before the last task, so that tasks modified
+            # in the same millisecond are found (and skipped above) rather than lost.
+            after = last_modified_at - timedelta(milliseconds=1)
+
     def _check_sync_project_id(self, project_id, workspace, models):
         """If we have a valid sync token for this project sync new events
         else sync the project"""
+        if (
+                self.resume
+                and SyncCheckpoint.objects.filter(
+                    project_id=project_id, finished=True, generation=self.generation
+                ).exists()
+        ):
+            self.logger.info("Skipping project %s, synced before", project_id)
+            return
+        self._sync_project_or_events(project_id, workspace, models)
+        if self.commit:
+            self.writer.flush()
+            SyncCheckpoint.objects.update_or_create(
+                project_id=project_id,
+                defaults={
+                    "finished": True,
+                    "generation": self.generation,
+                    "offset": None,
+                },
+            )
+
+    def _sync_project_or_events(self, project_id, workspace, models):
         new_sync = False
         try:
             sync_token = SyncToken.objects.get(project_id=project_id)
@@ -144,22 +567,14 @@ class AsanaSynchronizer(object):
             SyncToken.objects.create(project_id=project_id, sync=new_sync)
 
     def _get_workspace_ids(self, workspaces):
-        workspace_ids = []
-        bad_list = []
-        workspaces_ = self.client.workspaces.find_all()
+        workspaces_ = self.resolver.workspaces()
         if workspaces:
-            for workspace in workspaces:
-                for wks in workspaces_:
-                    if workspace in (wks["gid"], wks["name"]):
-                        workspace_ids.append(wks["gid"])
-                        break
-                else:
-                    bad_list.append(workspace)
+            workspace_ids, bad_list = workspaces_.resolve(workspaces)
         else:
-            workspace_ids = [wks["gid"] for wks in workspaces_]
+            workspace_ids, bad_list = list(workspaces_.gids), []
         if bad_list:
             if len(bad_list) == 1:
-                raise ValueError(f"{workspaces[0]} is not an Asana workspace")
+                raise ValueError(f"{bad_list[0]} is not an Asana workspace")
             raise ValueError(
                 f'Specified workspaces are not valid: {", ".join(bad_list)}'
             )
@@ -167,22 +582,13 @@ class AsanaSynchronizer(object):
         return sorted(workspace_ids, reverse=True)
 
     def _get_project_ids(self, projects, workspace_id):
-        project_ids = []
-        bad_list = []
-
-        projects_ = self.client.projects.find_all({"workspace": workspace_id})
+        projects_ = self.resolver.projects(workspace_id)
         self.logger.info("Sync project %s", projects)
 
         if projects:
-            for project in projects:
-                for prj in projects_:
-                    if project in (prj["gid"], prj["name"]):
-                        project_ids.append(prj["gid"])
-                        break
-                else:
-                    bad_list.append(project)
+            project_ids, bad_list = projects_.resolve(projects)
         else:
-            project_ids = [prj["gid"] for prj in projects_]
+            project_ids, bad_list = list(projects_.gids), []
         if bad_list:
             if len(bad_list) == 1:
                 raise ValueError(f"{bad_list[0]} is not an Asana project")
@@ -193,43 +599,83 @@ class AsanaSynchronizer(object):
         return sorted(project_ids, reverse=True)
 
     def _set_webhook(self, workspace, project_id):
-        """Sets a webhook if the setting is configured and
-        a webhook does not currently exist"""
+        """Marks this project as wanting a webhook, if the setting is configured
+
+        The webhooks of all marked projects are checked together, with one
+        listing per workspace, by _reconcile_webhooks.
+        """
         if not (self.commit and settings.DJASANA_WEBHOOK_URL):
             return
-        webhooks = list(
-            self.client.webhooks.get_all(
-                {"workspace": workspace.remote_id, "resource": project_id}
-            )
-        )
-        if webhooks:
-            # If there is exactly one, and it is active, we are good to go,
-            # else delete them and start a new one.
-            webhooks_ = Webhook.objects.filter(project_id=project_id)
-            if len(webhooks) == webhooks_.count() == 1 and webhooks[0]["active"]:
-                return
-            for webhook in webhooks:
-                self.client.webhooks.delete_by_id(webhook["id"])
-            Webhook.objects.filter(
-                id__in=webhooks_.values_list("id", flat=True)[1:]
-            ).delete()
-        set_webhook(self.client, project_id)
+        self._webhook_project_ids.append(str(project_id))
+
+    def _reconcile_webhooks(self, workspace_id):
+        """Sets webhooks for the projects of this workspace that want one.
+
+        All webhooks of the workspace are read with one listing and indexed by
+        resource. A project with exactly one active webhook in Asana and exactly one
+        local Webhook is left alone; otherwise its webhooks in Asana are deleted,
+        its redundant local Webhooks too, and a new webhook is set.
+        """
+        project_ids, self._webhook_project_ids = self._webhook_project_ids, []
+        if not project_ids:
+            return
+        remote = defaultdict(list)
+        for webhook in self.client.webhooks.get_all({"workspace": workspace_id}):
+            remote[str(webhook["resource"]["gid"])].append(webhook)
+        local = defaultdict(list)
+        for project_id, pk in (
+                Webhook.objects.filter(project_id__in=project_ids)
+                .order_by("pk")
+                .values_list("project_id", "pk")
+        ):
+            local[str(project_id)].append(pk)
+        redundant = []
+        for project_id in project_ids:
+            webhooks = remote.get(project_id)
+            if webhooks:
+                if (
+                        len(webhooks) == len(local[project_id]) == 1
+                        and webhooks[0]["active"]
+                ):
+                    continue
+                for webhook in webhooks:
+                    self.client.webhooks.delete_by_id(webhook["gid"])
+                redundant.extend(local[project_id][1:])
+                forget_webhook_secret(project_id)
+            set_webhook(self.client, project_id)
+        if redundant:
+            Webhook.objects.filter(pk__in=redundant).delete()
 
     def _process_events(self, project_id, events, models):
         project = Project.objects.get(remote_id=project_id)
         ignored_tasks = 0
-        for event in events["data"]:
+        # Stories are read together through the Batch API, before anything is removed.
+        stories = []
+        if self.commit:
+            log_events(events["data"], project_id)
+        coalesced = coalesce_events(events["data"])
+        self.logger.debug(
+            "Coalesced %s events into %s", len(events["data"]), len(coalesced)
+        )
+        for event in coalesced:
             if event["type"] == "project":
                 if Project in models:
                     if event["action"] == "removed":
+                        self._sync_stories(stories)
+                        stories = []
+                        self.writer.flush()
+                        self.identity.discard(Project, event["resource"]["gid"])
                         Project.objects.get(remote_id=event["resource"]["gid"]).delete()
                     else:
-                        self._sync_project_id(project_id, models)
+                        self._sync_project_metadata(event["resource"]["gid"])
                 else:
                     ignored_tasks += 1
             elif event["type"] == "task":
                 if Task in models:
                     if event["action"] == "removed":
+                        self._sync_stories(stories)
+                        stories = []
+                        self.writer.flush()
                         Task.objects.get(remote_id=event["resource"]["gid"]).delete()
                     else:
                         self._sync_task(event["resource"], project, models)
@@ -237,10 +683,12 @@ class AsanaSynchronizer(object):
                     ignored_tasks += 1
             elif event["type"] == "story":
                 if Story in models:
-                    self._sync_story(event["resource"])
+                    stories.append(event["resource"])
                 else:
                     ignored_tasks += 1
-        tasks_done = len(events["data"]) - ignored_tasks
+        self._sync_stories(stories)
+        self.writer.flush()
+        tasks_done = len(coalesced) - ignored_tasks
         if self.commit:
             message = "Successfully synced {0} events for project {1}.".format(
                 tasks_done, project.name
@@ -253,33 +701,66 @@ class AsanaSynchronizer(object):
                 self.stdout.write(self.style.SUCCESS(message))
             self.logger.info(message)
 
+    def _sync_project_metadata(self, project_id):
+        """Sync the fields, members and followers of this project, but not its tasks"""
+        project_dict = self.client.projects.find_by_id(project_id)
+        self.logger.debug("Sync project %s", project_dict["name"])
+        self.logger.debug(project_dict)
+        if self.commit:
+            sync_project(
+                self.client,
+                project_dict,
+                writer=self.writer,
+                custom_fields=self.custom_fields,
+            )
+
     def _sync_project_id(self, project_id, models):
         """Sync this project by polling it. Returns boolean 'is archived?'"""
         project_dict = self.client.projects.find_by_id(project_id)
         self.logger.debug("Sync project %s", project_dict["name"])
         self.logger.debug(project_dict)
+        project = None
         if self.commit:
-            project = sync_project(self.client, project_dict)
+            project = sync_project(
+                self.client,
+                project_dict,
+                writer=self.writer,
+                custom_fields=self.custom_fields,
+            )
 
         if Task in models and not project_dict["archived"] or self.process_archived:
-            for task in self.client.tasks.find_all({"project": project_id}):
-                self._sync_task(task, project, models)
-                time.sleep(0.5)
-            # Delete local tasks for this project that are no longer in Asana.
-            tasks_to_delete = (
-                Task.objects.filter(projects=project)
-                .exclude(remote_id__in=self.synced_ids)
-                .exclude(remote_id__isnull=True)
-            )
-            if tasks_to_delete.count() > 0:
-                id_list = list(tasks_to_delete.values_list("remote_id", flat=True))
-                tasks_to_delete.delete()
-                message = "Deleted {} tasks no longer present: {}".format(
-                    len(id_list), id_list
+            checkpoint = None
+            if self.commit and self.resume:
+                checkpoint = SyncCheckpoint.objects.get_or_create(
+                    project_id=project_id, defaults={"generation": self.generation}
+                )[0]
+            elif self.commit:
+                # Without --resume, a checkpoint left by an interrupted run is reset.
+                checkpoint = SyncCheckpoint.objects.update_or_create(
+                    project_id=project_id,
+                    defaults={
+                        "finished": False,
+                        "generation": self.generation,
+                        "offset": None,
+                    },
+                )[0]
+            resumed_at = checkpoint.offset if checkpoint else None
+            try:
+                self._sync_project_tasks(project_id, project, models, checkpoint)
+            except InvalidRequestError:
+                if resumed_at is None:
+                    raise
+                # Asana offsets expire; start this project over.
+                self.logger.warning(
+                    "Cannot resume project %s at offset %s; syncing it from the start",
+                    project_id,
+                    resumed_at,
                 )
-                if self.stdout:
-                    self.stdout.write(self.style.SUCCESS(message))
-                self.logger.info(message)
+                checkpoint.offset = resumed_at = None
+                self._sync_project_tasks(project_id, project, models, checkpoint)
+            self.writer.flush()
+            if self.commit:
+                self._delete_stale_tasks(project)
         if self.commit:
             message = f"Successfully synced project {project.name}."
             if self.stdout:
@@ -287,40 +768,429 @@ class AsanaSynchronizer(object):
             self.logger.info(message)
         return project_dict["archived"]
 
+    def _delete_stale_tasks(self, project):
+        """Delete local tasks for this project that are no longer in Asana.
+
+        Every task synced in this run is stamped with its generation, so the ones
+        with an earlier generation were not seen. They are deleted in batches.
+        """
+        stale = (
+            Task.objects.filter(projects=project)
+            .filter(
+                Q(sync_generation__lt=self.generation)
+                | Q(sync_generation__isnull=True)
+            )
+            .exclude(remote_id__isnull=True)
+        )
+        deleted = 0
+        while True:
+            pks = list(stale.values_list("pk", flat=True)[:DELETE_BATCH_SIZE])
+            if not pks:
+                break
+            Task.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+        if deleted:
+            message = "Deleted {} tasks no longer present in project {}.".format(
+                deleted, project.name
+            )
+            if self.stdout:
+                self.stdout.write(self.style.SUCCESS(message))
+            self.logger.info(message)
+
+    def _sync_project_tasks(self, project_id, project, models, checkpoint):
+        """Syncs the tasks of this project, from the checkpoint's offset if any"""
+        options = {"fields": get_opt_fields(Task)}
+        if checkpoint and checkpoint.offset:
+            options["offset"] = checkpoint.offset
+        tasks = self.client.tasks.find_all({"project": project_id}, **options)
+        self._sync_tasks(tasks, project, models, checkpoint=checkpoint)
+
+    def _get_full_record(self, resource, record, model):
+        """Returns the complete record of an object listed by Asana.
+
+        Lists are requested with the opt_fields of their model, so usually the
+        record is already complete and no further request is made.
+        """
+        if is_complete(record, get_opt_fields(model)):
+            return record
+        return getattr(self.client, resource).find_by_id(record["gid"])
+
+    def _get_full_records(self, resource, records, model, missing=(NotFoundError,)):
+        """Returns the complete records of objects listed by Asana, in order.
+
+        Records that are not complete already are fetched together through the
+        Batch API, up to ten per request. Objects whose read raises one of missing
+        are returned as None.
+        """
+        fields = get_opt_fields(model)
+        with self.client.batch() as batch:
+            results = [
+                record
+                if is_complete(record, fields)
+                else batch.get(f"/{resource}/{record['gid']}", fields=fields)
+                for record in records
+            ]
+        full_records = []
+        for result in results:
+            if isinstance(result, Future):
+                try:
+                    result = result.result()
+                except missing as error:
+                    self.logger.info(error)
+                    result = None
+            full_records.append(result)
+        return full_records
+
     def _sync_story(self, story):
-        story_id = story.get("gid")
-        try:
-            story_dict = self.client.stories.find_by_id(story_id)
-        except NotFoundError as error:
-            self.logger.info(error.response)
-            return
+        self._sync_stories([story])
+
+    def _sync_stories(self, stories):
+        for story_dict in self._get_full_records("stories", stories, Story):
+            if story_dict is not None:
+                self._write_story(story_dict)
+
+    def _write_story(self, story_dict):
         self.logger.debug(story_dict)
         remote_id = story_dict["gid"]
-        sync_story(remote_id, story_dict)
+        sync_story(remote_id, story_dict, writer=self.writer)
 
     def _sync_tag(self, tag, workspace):
-        tag_dict = self.client.tags.find_by_id(tag["gid"])
+        tag_dict = self._get_full_record("tags", tag, Tag)
         self.logger.debug(tag_dict)
         if self.commit:
             remote_id = tag_dict["gid"]
-            tag_dict["workspace"] = workspace
+            tag_dict.pop("workspace", None)
+            tag_dict["workspace_id"] = workspace.remote_id if workspace else None
             followers_dict = tag_dict.pop("followers")
             pop_unsupported_fields(tag_dict, Tag)
-            tag = Tag.objects.get_or_create(remote_id=remote_id, defaults=tag_dict)[0]
-            follower_ids = [follower["gid"] for follower in followers_dict]
-            followers = User.objects.filter(id__in=follower_ids)
-            tag.followers.set(followers)
+            self.writer.upsert(Tag, remote_id, tag_dict)
+            self.writer.set_m2m(
+                Tag,
+                "followers",
+                remote_id,
+                [follower["gid"] for follower in followers_dict],
+            )
+
+    def _sync_task(self, task, project, models):
+        """Sync this task and its parent, dependencies, and subtasks"""
+        self._sync_tasks([task], project, models)
+
+    def _sync_tasks(self, tasks, project, models, checkpoint=None):
+        """Sync a sequence of tasks with their parents, dependencies and subtasks
+
+        When tasks is read page by page from Asana, each page is synced in full,
+        trees and all, and then the checkpoint is moved to the next page.
+        """
+        for page, next_offset in self._split_pages(tasks):
+            self._sync_task_tree(page, project, models)
+            if checkpoint is not None and next_offset:
+                checkpoint.offset = next_offset
+                checkpoint.save(update_fields=["offset", "updated_at"])
+
+    @staticmethod
+    def _split_pages(tasks):
+        """Yields (page, offset of the next page) for tasks read from Asana
+
+        A plain sequence of tasks is a single page, with no next page.
+        """
+        page = []
+        offset = None
+        for task in tasks:
+            task_offset = getattr(tasks, "offset", None)
+            if page and task_offset != offset:
+                yield page, task_offset
+                page = []
+            offset = task_offset
+            page.append(task)
+        if page:
+            yield page, None
+
+    def _sync_task_tree(self, tasks, project, models):
+        """Sync tasks and the subtasks and dependencies under them, breadth first
+
+        Each level of the tree is fetched as a whole, ten tasks per batch request
+        and concurrently when max_workers > 1, then written before the next level
+        is fetched. Once the tree is written, the parents of its tasks that are
+        neither synced nor stored are synced too, without their subtasks. Parent
+        and dependency links are set last, when all the rows they refer to exist.
+        """
+        parents = {}
+        dependencies = {}
+        checked_parents = set()
+        level = tasks
+        skip_subtasks = False
+        while level:
+            next_level = {}
+            unchanged, watermarks = set(), {}
+            if Task in models and self.commit:
+                unchanged, watermarks = self._read_stored_tasks(level)
+            bundles = self._fetch_tasks(
+                level,
+                models,
+                skip_subtasks=skip_subtasks,
+                unchanged=unchanged,
+                watermarks=watermarks,
+            )
+            for bundle in bundles:
+                task_dict = bundle["task"]
+                if task_dict is not None:
+                    if task_dict["gid"] in self.synced_ids:
+                        # Already written as part of an earlier task of this tree.
+                        continue
+                    parent = task_dict.pop("parent", None)
+                    dependencies_ = task_dict.pop("dependencies", None) or []
+                    if Task in models and self.commit:
+                        remote_id = task_dict["gid"]
+                        if parent:
+                            parents[remote_id] = parent
+                        if not skip_subtasks:
+                            dependencies[remote_id] = [
+                                dependency["gid"] for dependency in dependencies_
+                            ]
+                            for child in bundle["subtasks"] + dependencies_:
+                                if child["gid"] not in self.synced_ids:
+                                    next_level.setdefault(child["gid"], child)
+                if bundle["unchanged"]:
+                    self._keep_task(task_dict, project)
+                else:
+                    self.stats["tasks_fetched"] += 1
+                    self._write_task(bundle, project, models)
+            for chunk in chunked(unchanged, LINK_BATCH_SIZE):
+                Task.objects.filter(remote_id__in=chunk).update(
+                    sync_generation=self.generation
+                )
+            skip_subtasks = not next_level
+            if skip_subtasks:
+                next_level = self._missing_parents(parents, checked_parents)
+            level = list(next_level.values())
+        self._link_tasks(parents, dependencies)
 
-    def _sync_task(self, task, project, models, skip_subtasks=False):
-        """Sync this task and its parent, dependencies, and subtasks
+    def _read_stored_tasks(self, tasks):
+        """Returns what is stored about tasks that tells what to read from Asana
 
-        For parents and subtasks, this method is called recursively,
-        so skip_subtasks True is passed when syncing a parent task from a subtask.
+        That is the gids of the tasks whose modified_at is the one stored when
+        they were last synced with their attachments and stories, and the story
+        watermarks of the others, by gid.
+        """
+        unchanged = set()
+        watermarks = {}
+        gids = [task["gid"] for task in tasks if task["gid"] not in self.synced_ids]
+        modified = {task["gid"]: as_datetime(task.get("modified_at")) for task in tasks}
+        for chunk in chunked(gids, LINK_BATCH_SIZE):
+            for remote_id, modified_at, story_offset, story_at in Task.objects.filter(
+                    remote_id__in=chunk
+            ).values_list(
+                "remote_id", "synced_modified_at", "last_story_offset", "last_story_at"
+            ):
+                gid = str(remote_id)
+                if modified_at is not None and modified_at == modified[gid]:
+                    unchanged.add(gid)
+                elif story_at is not None:
+                    watermarks[gid] = (story_offset, story_at)
+        return unchanged, watermarks
+
+    def _keep_task(self, task_dict, project):
+        """Records that an unchanged task is still there, in this project
+
+        Asana does not count a move to another project as a modification, so the
+        task's projects are brought up to date.
+        """
+        remote_id = task_dict["gid"]
+        project_ids = [project_["gid"] for project_ in task_dict.get("projects") or []]
+        if project:
+            project_ids.append(project.remote_id)
+        self.writer.add_m2m(Task, "projects", remote_id, project_ids)
+        self.synced_ids.add(remote_id)
+        self.stats["tasks_unchanged"] += 1
+
+    def _missing_parents(self, parents, checked):
+        """Returns the parents, by gid, that are neither synced nor stored"""
+        candidates = {
+            parent["gid"]: parent
+            for parent in parents.values()
+            if parent["gid"] not in self.synced_ids and parent["gid"] not in checked
+        }
+        checked.update(candidates)
+        for chunk in chunked(candidates, LINK_BATCH_SIZE):
+            for remote_id in Task.objects.filter(remote_id__in=chunk).values_list(
+                "remote_id", flat=True
+            ):
+                candidates.pop(str(remote_id))
+        return candidates
+
+    def _link_tasks(self, parents, dependencies):
+        """Sets the parents and dependencies of tasks, once their rows are written
+
+        A parent that could not be synced is left out rather than linked to.
+        """
+        for remote_id, dependency_ids in dependencies.items():
+            self.writer.set_m2m(Task, "dependencies", remote_id, dependency_ids)
+        self.writer.flush()
+        if not parents:
+            return
+        parent_ids = {int(parent["gid"]) for parent in parents.values()}
+        stored = set()
+        for chunk in chunked(parent_ids, LINK_BATCH_SIZE):
+            stored.update(
+                Task.objects.filter(remote_id__in=chunk).values_list(
+                    "remote_id", flat=True
+                )
+            )
+        changed = []
+        for chunk in chunked(parents, LINK_BATCH_SIZE):
+            for task in Task.objects.filter(remote_id__in=chunk).only(
+                    "remote_id", "parent"
+            ):
+                parent_id = int(parents[str(task.remote_id)]["gid"])
+                if parent_id in stored and task.parent_id != parent_id:
+                    task.parent_id = parent_id
+                    changed.append(task)
+        Task.objects.bulk_update(changed, ["parent"], batch_size=LINK_BATCH_SIZE)
+
+    def _fetch_tasks(
+            self, tasks, models, skip_subtasks=False, unchanged=(), watermarks=None
+    ):
+        """Yields task bundles in the order of tasks
+
+        Tasks whose gid is in unchanged are only asked for their subtasks. Only
+        stories newer than the watermark of their task, by gid, are read.
+        At most two bundles per worker are held in memory at a time.
+        """
+        watermarks = watermarks or {}
+        tasks = self._complete_tasks(tasks, unchanged)
+        if self.max_workers <= 1:
+            for task in tasks:
+                yield self._fetch_task(
+                    task,
+                    models,
+                    skip_subtasks=skip_subtasks,
+                    unchanged=task["gid"] in unchanged,
+                    watermark=watermarks.get(task["gid"]),
+                )
+            return
+        pending = deque()
+        for task in tasks:
+            pending.append(
+                self.executor.submit(
+                    self._fetch_task,
+                    task,
+                    models,
+                    skip_subtasks=skip_subtasks,
+                    unchanged=task["gid"] in unchanged,
+                    watermark=watermarks.get(task["gid"]),
+                )
+            )
+            if len(pending) >= self.max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _complete_tasks(self, tasks, unchanged=()):
+        """Yields the complete records of tasks, reading ten at a time if needed
+
+        A task that can no longer be read, or whose gid is in unchanged, is
+        yielded as given. _fetch_task finds out about the former and its bundle
+        says so.
+        """
+        for chunk in chunked(tasks, Batch.MAX_ACTIONS):
+            records = iter(
+                self._get_full_records(
+                    "tasks",
+                    [task for task in chunk if task["gid"] not in unchanged],
+                    Task,
+                    missing=(ForbiddenError, NotFoundError),
+                )
+            )
+            for task in chunk:
+                record = None if task["gid"] in unchanged else next(records)
+                yield task if record is None else record
+
+    def _fetch_task(
+            self, task, models, skip_subtasks=False, unchanged=False, watermark=None
+    ):
+        """Collects everything from Asana needed to write this task
+
+        This does not touch the database, so it is safe to call from a worker thread.
+        Returns a dict whose 'task' is None if the task is no longer accessible.
+        An unchanged task is not read again, and neither are its attachments and
+        stories; only its subtasks are listed. Of the stories of other tasks, only
+        those from the watermark on are read.
         """
         task_id = task["gid"]
+        bundle = {
+            "gid": task_id,
+            "task": None,
+            "unchanged": unchanged,
+            "subtasks": [],
+            "attachments": [],
+            "stories": [],
+            "story_watermark": None,
+        }
         try:
-            task_dict = self.client.tasks.find_by_id(task_id)
+            bundle["task"] = (
+                task if unchanged else self._get_full_record("tasks", task, Task)
+            )
         except (ForbiddenError, NotFoundError):
+            return bundle
+        if not self.commit:
+            return bundle
+        # Asana says how many subtasks a task has, so a task without any is not
+        # asked for them.
+        has_subtasks = bundle["task"].get("num_subtasks", 1)
+        if Task in models and not skip_subtasks and has_subtasks:
+            bundle["subtasks"] = list(
+                self.client.tasks.subtasks(task_id, fields=get_opt_fields(Task))
+            )
+        if unchanged:
+            return bundle
+        if Attachment in models:
+            attachments = self.client.attachments.find_by_task(
+                task_id, fields=get_opt_fields(Attachment)
+            )
+            bundle["attachments"] = [
+                attachment_dict
+                for attachment_dict in self._get_full_records(
+                    "attachments", list(attachments), Attachment
+                )
+                if attachment_dict is not None
+            ]
+        if Story in models:
+            stories, bundle["story_watermark"] = self._list_new_stories(
+                task_id, watermark
+            )
+            bundle["stories"] = [
+                story_dict
+                for story_dict in self._get_full_records("stories", stories, Story)
+                if story_dict is not None
+            ]
+        return bundle
+
+    def _list_new_stories(self, task_id, watermark):
+        """Lists the stories of a task from its watermark on; see newer_stories"""
+        offset = watermark[0] if watermark else None
+        options = {"fields": get_opt_fields(Story)}
+        if offset:
+            options["offset"] = offset
+        try:
+            stories = self.client.stories.find_by_task(task_id, **options)
+            return newer_stories(with_offsets(stories), watermark)
+        except InvalidRequestError:
+            if not offset:
+                raise
+        # Asana offsets expire; read the task's stories from the start.
+        stories = self.client.stories.find_by_task(
+            task_id, fields=get_opt_fields(Story)
+        )
+        return newer_stories(with_offsets(stories), (None, watermark[1]))
+
+    def _write_task(self, bundle, project, models):
+        """Writes a task fetched by _fetch_task, with its attachments and stories
+
+        Its parent, dependencies and subtasks are handled by _sync_task_tree.
+        """
+        task_id = bundle["gid"]
+        task_dict = bundle["task"]
+        if task_dict is None:
             try:
                 Task.objects.get(remote_id=task_id).delete()
             except Task.DoesNotExist:
@@ -331,42 +1201,44 @@ class AsanaSynchronizer(object):
 
         if Task in models and self.commit:
             remote_id = task_dict["gid"]
-            parent = task_dict.pop("parent", None)
-            dependencies = task_dict.pop("dependencies", None) or []
-            if parent:
-                # If this is a task we already know about, assume it was just synced.
-                parent_id = parent["gid"]
-                if (
-                        parent_id not in self.synced_ids
-                        and not Task.objects.filter(remote_id=parent_id).exists()
-                ):
-                    self._sync_task(parent, project, models, skip_subtasks=True)
-                task_dict["parent_id"] = parent_id
-            task_ = sync_task(remote_id, task_dict, project, sync_tags=Tag in models)
-            self.synced_ids.append(remote_id)
-            if not skip_subtasks:
-                for subtask in self.client.tasks.subtasks(task_id):
-                    if subtask["gid"] not in self.synced_ids:
-                        self._sync_task(subtask, project, models)
-                if dependencies:
-                    for subtask in dependencies:
-                        if subtask["gid"] not in self.synced_ids:
-                            self._sync_task(subtask, project, models)
-                    task_.dependencies.set(
-                        Task.objects.filter(
-                            remote_id__in=[dep["gid"] for dep in dependencies]
-                        )
-                    )
+            task_dict["sync_generation"] = self.generation
+            if bundle["story_watermark"]:
+                (
+                    task_dict["last_story_offset"],
+                    task_dict["last_story_at"],
+                ) = bundle["story_watermark"]
+            sync_task(
+                remote_id,
+                task_dict,
+                project,
+                sync_tags=Tag in models,
+                writer=self.writer,
+            )
+            self.synced_ids.add(remote_id)
         if Attachment in models and self.commit:
-            for attachment in self.client.attachments.find_by_task(task_id):
-                sync_attachment(self.client, task_, attachment["gid"])
+            for attachment_dict in bundle["attachments"]:
+                sync_attachment(
+                    self.client,
+                    task_id,
+                    attachment_dict["gid"],
+                    attachment_dict,
+                    writer=self.writer,
+                )
         if Story in models and self.commit:
-            for story in self.client.stories.find_by_task(task_id):
-                self._sync_story(story)
+            for story_dict in bundle["stories"]:
+                self._write_story(story_dict)
+        if {Task, Attachment, Story} <= set(models) and self.commit:
+            # Buffered after the attachments and stories, so it is never written
+            # before them; only then may a later run skip the task as unchanged.
+            self.writer.upsert(
+                Task,
+                task_id,
+                {"synced_modified_at": as_datetime(task_dict.get("modified_at"))},
+            )
         return
 
     def _sync_team(self, team):
-        team_dict = self.client.teams.find_by_id(team["gid"])
+        team_dict = self._get_full_record("teams", team, Team)
         self.logger.debug(team_dict)
         if self.commit:
             remote_id = team_dict["gid"]
@@ -374,21 +1246,22 @@ class AsanaSynchronizer(object):
             team_dict["organization_id"] = organization["gid"]
             team_dict["organization_name"] = organization["name"]
             pop_unsupported_fields(team_dict, Team)
-            Team.objects.get_or_create(remote_id=remote_id, defaults=team_dict)
+            self.writer.upsert(Team, remote_id, team_dict)
 
     def _sync_user(self, user, workspace):
-        user_dict = self.client.users.find_by_id(user["gid"])
+        user_dict = self._get_full_record("users", user, User)
         self.logger.debug(user_dict)
         if self.commit:
             remote_id = user_dict["gid"]
             user_dict.pop("workspaces")
             if user_dict["photo"]:
                 user_dict["photo"] = user_dict["photo"]["image_128x128"]
-            user = User.objects.update_or_create(
-                remote_id=remote_id, defaults=user_dict
-            )[0]
+            pop_unsupported_fields(user_dict, User)
+            self.writer.upsert(User, remote_id, user_dict)
             if workspace:
-                user.workspaces.add(workspace)
+                self.writer.add_m2m(
+                    User, "workspaces", remote_id, [workspace.remote_id]
+                )
 
     def _get_models(self):
         """Returns a list of models to sync"""
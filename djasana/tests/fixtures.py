@@ -1,7 +1,10 @@
 from collections import defaultdict
 
+from asana.error import AsanaError
 from django.utils import timezone
 
+from djasana.connect import Batch
+
 
 def fake_response(**kwargs):
     response = defaultdict(lambda: None, **kwargs)
@@ -10,6 +13,26 @@ def fake_response(**kwargs):
     return response
 
 
+def mock_batch(client):
+    """Makes batches of a mock client answer from its find_by_id mocks"""
+
+    def post(path, data, **options):
+        results = []
+        for action in data["actions"]:
+            _, resource, gid = action["relative_path"].split("/")
+            try:
+                record = getattr(client, resource).find_by_id(gid)
+            except AsanaError as error:
+                results.append({"status_code": error.status, "body": {}})
+            else:
+                results.append({"status_code": 200, "body": {"data": record}})
+        return results
+
+    client.post.side_effect = post
+    client.batch.side_effect = lambda: Batch(client)
+    client.rate_limiter = None
+
+
 def attachment(**kwargs):
     defaults = {
         "gid": "1",
@@ -138,6 +161,7 @@ def task(*_dummy, **kwargs):
         "memberships": None,
         "modified_at": timezone.now(),
         "notes": "A note.",
+        "num_subtasks": 0,
         "parent": None,
         "projects": [project()],
         "tags": [tag()],
@@ -176,7 +200,7 @@ def user(**kwargs):
 
 def webhook(**kwargs):
     defaults = {
-        "id": 1,
+        "gid": "1",
         "resource": project(),
         "target": "https://example.com/receive-webhook/7654",
         "active": True,
@@ -0,0 +1,85 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django.test import override_settings, TestCase
+from djasana.async_synchronizer import AsyncAsanaSynchronizer
+from djasana.connect import AsyncClient
+from djasana.models import Story, Task
+from djasana.tests.fixtures import mock_batch, project, story, task, workspace
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+@override_settings(
+    ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None, ROOT_URLCONF="djasana.urls"
+)
+class AsyncAsanaSynchronizerTestCase(TestCase):
+    """Tests of AsyncAsanaSynchronizer that use mock returns from Asana"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.workspaces.find_all.return_value = [workspace()]
+        self.client.workspaces.find_by_id.return_value = workspace()
+        self.client.projects.find_all.return_value = [project()]
+        self.client.projects.find_by_id.return_value = project()
+        self.client.tasks.find_all.return_value = [
+            task(gid=str(gid)) for gid in range(1, 21)
+        ]
+        mock_batch(self.client)
+        patcher = patch("djasana.synchronizer.client_connect", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = []
+        patcher = patch(
+            "djasana.async_synchronizer.async_client_connect",
+            side_effect=lambda: AsyncClient(
+                "foo", transport=httpx.MockTransport(self.respond)
+            ),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, request):
+        self.requests.append(request)
+        parts = request.url.path.split("/")[3:]
+        if parts[0] == "tasks" and len(parts) == 2:
+            if parts[1] == "404":
+                return httpx.Response(404, json={"errors": [{"message": "gone"}]})
+            data = task(gid=parts[1], name=f"Task {parts[1]}")
+        elif parts[-1] == "stories":
+            data = [story(gid=parts[1], target=task(gid=parts[1]))]
+        elif parts[0] == "stories":
+            data = story(gid=parts[1], target=task(gid=parts[1]))
+        else:
+            data = []
+        return httpx.Response(200, text=json.dumps({"data": data}, default=str))
+
+    def get_synchronizer(self, **kwargs):
+        kwargs.setdefault("workspaces", [])
+        kwargs.setdefault("projects", [])
+        return AsyncAsanaSynchronizer(**kwargs)
+
+    def test_async_sync(self):
+        synchronizer = self.get_synchronizer(max_tasks=8)
+        synchronizer.run_sync()
+        self.assertEqual(20, Task.objects.count())
+        self.assertEqual(20, Story.objects.count())
+        self.assertEqual("Task 7", Task.objects.get(remote_id=7).name)
+        self.assertFalse(self.client.tasks.find_by_id.called)
+        self.assertIsNone(synchronizer._loop)
+        stories = [
+            request for request in self.requests if request.url.path.endswith("stories")
+        ]
+        self.assertEqual("100", stories[0].url.params["limit"])
+
+    def test_missing_task_is_deleted(self):
+        Task.objects.create(remote_id=404, gid="404", name="Gone")
+        self.client.tasks.find_all.return_value = [task(gid="404")]
+        self.client.tasks.find_by_id.side_effect = NotImplementedError
+        self.get_synchronizer().run_sync()
+        self.assertFalse(Task.objects.filter(remote_id=404).exists())
@@ -0,0 +1,76 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from djasana.bulk import BulkWriter
+from djasana.models import Tag, Task, User, Workspace
+
+
+class BulkWriterTestCase(TestCase):
+    def setUp(self):
+        self.workspace = Workspace.objects.create(remote_id=1, gid="1", name="Test")
+
+    def test_upsert_creates_and_updates(self):
+        Task.objects.create(remote_id=1, gid="1", name="Old")
+        writer = BulkWriter()
+        writer.upsert(Task, "1", {"name": "New"})
+        writer.upsert(Task, "2", {"name": "Other"})
+        self.assertEqual(0, Task.objects.filter(name="New").count())
+        writer.flush()
+        self.assertEqual("New", Task.objects.get(remote_id=1).name)
+        self.assertEqual("Other", Task.objects.get(remote_id=2).name)
+        self.assertEqual(0, writer.pending)
+
+    def test_insert_keeps_existing_rows(self):
+        User.objects.create(remote_id=1, gid="1", name="Existing")
+        writer = BulkWriter()
+        writer.insert(User, 1, {"name": "Changed"})
+        writer.insert(User, 2, {"name": "Created"})
+        writer.flush()
+        self.assertEqual("Existing", User.objects.get(remote_id=1).name)
+        self.assertEqual("Created", User.objects.get(remote_id=2).name)
+
+    def test_flushes_at_batch_size(self):
+        writer = BulkWriter(batch_size=2)
+        writer.upsert(Tag, 1, {"name": "One", "workspace_id": 1})
+        self.assertEqual(0, Tag.objects.count())
+        writer.upsert(Tag, 2, {"name": "Two", "workspace_id": 1})
+        self.assertEqual(2, Tag.objects.count())
+
+    def test_m2m_after_rows(self):
+        writer = BulkWriter()
+        writer.set_m2m(Tag, "followers", 1, ["1", "2"])
+        writer.upsert(Tag, 1, {"name": "One", "workspace_id": 1})
+        writer.insert(User, 1, {"name": "Follower"})
+        writer.insert(User, 2, {"name": "Follower"})
+        writer.add_m2m(User, "workspaces", 1, [1])
+        writer.flush()
+        tag = Tag.objects.get(remote_id=1)
+        self.assertEqual(
+            {1, 2}, set(tag.followers.values_list("remote_id", flat=True))
+        )
+        self.assertEqual(
+            [self.workspace], list(User.objects.get(remote_id=1).workspaces.all())
+        )
+        writer.set_m2m(Tag, "followers", 1, ["2"])
+        writer.flush()
+        self.assertEqual([2], list(tag.followers.values_list("remote_id", flat=True)))
+
+    def test_m2m_queries_do_not_grow_with_rows(self):
+        def flush_followers(count):
+            writer = BulkWriter()
+            for remote_id in range(1, count + 1):
+                writer.insert(User, remote_id, {"name": "Follower"})
+                writer.upsert(Task, remote_id, {"name": "Task"})
+                writer.set_m2m(Task, "followers", remote_id, [remote_id, 1])
+            writer.flush()
+            writer.set_m2m(Task, "followers", 1, [])
+            for remote_id in range(2, count + 1):
+                writer.set_m2m(Task, "followers", remote_id, [remote_id])
+            with CaptureQueriesContext(connection) as queries:
+                writer.flush()
+            return len(queries)
+
+        self.assertEqual(flush_followers(2), flush_followers(20))
+        self.assertEqual(0, Task.objects.get(remote_id=1).followers.count())
+        followers = Task.objects.get(remote_id=20).followers
+        self.assertEqual([20], list(followers.values_list("remote_id", flat=True)))
@@ -1,11 +1,31 @@
+import asyncio
 import requests
+import threading
 import unittest
+from unittest.mock import Mock, patch
+
+from requests.exceptions import ChunkedEncodingError
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test import override_settings
 
-from asana.error import NoAuthorizationError
-from djasana.connect import client_connect
+from asana import Client as AsanaClient
+from asana.error import NoAuthorizationError, NotFoundError, RateLimitEnforcedError
+from djasana.connect import (
+    async_client_connect,
+    AsyncClient,
+    Batch,
+    client_connect,
+    Client,
+    get_resolver,
+    PAGE_SIZE,
+    RateLimiter,
+)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 
 class ClientConnectTestCase(unittest.TestCase):
@@ -21,3 +41,239 @@ class ClientConnectTestCase(unittest.TestCase):
                 client_connect()
             except requests.exceptions.ConnectionError:
                 self.skipTest("No Internet connection")
+
+    @override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None)
+    def test_connect_rate_limiter(self):
+        with override_settings(ASANA_RATE_LIMIT=1500):
+            self.assertEqual(1500, client_connect().rate_limiter.capacity)
+        with override_settings(ASANA_RATE_LIMIT=None):
+            self.assertIsNone(client_connect().rate_limiter)
+
+    @override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None)
+    @patch("djasana.connect.Client")
+    def test_clients_are_pooled_per_thread(self, mock_client):
+        mock_client.access_token.side_effect = lambda token: Mock(options={})
+        client = client_connect()
+        self.assertIs(client, client_connect())
+        self.assertIsNot(client, client_connect(pooled=False))
+        with override_settings(ASANA_ACCESS_TOKEN="bar"):
+            self.assertIsNot(client, client_connect())
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(client_connect()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(client, clients[0])
+        self.assertIsNotNone(client.rate_limiter)
+        self.assertIs(client.rate_limiter, clients[0].rate_limiter)
+        self.assertIs(client.rate_limiter, client_connect(pooled=False).rate_limiter)
+
+    @override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE="Other")
+    def test_workspace_is_resolved_once(self):
+        client = Mock(options={})
+        client.workspaces.find_all.return_value = iter(
+            [{"gid": "1", "name": "Test"}, {"gid": "2", "name": "Other"}]
+        )
+        with patch.object(Client, "access_token", return_value=client):
+            client_connect(pooled=False)
+        self.assertEqual("2", client.options["workspace_id"])
+        workspaces = get_resolver(client).workspaces()
+        self.assertEqual(
+            (["2", "1"], ["3"]), workspaces.resolve(["Other", "1", "3"])
+        )
+        self.assertEqual(1, client.workspaces.find_all.call_count)
+
+
+def rate_limit_error(retry_after):
+    return RateLimitEnforcedError(Mock(headers={"Retry-After": str(retry_after)}))
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_bucket_allows_burst(self):
+        limiter = RateLimiter(requests_per_minute=60)
+        delays = [limiter.reserve() for _ in range(60)]
+        self.assertEqual([0.0] * 60, delays)
+        self.assertAlmostEqual(1.0, limiter.reserve(), places=1)
+
+    def test_throttle_pauses_for_retry_after(self):
+        limiter = RateLimiter(requests_per_minute=60)
+        limiter.throttle(30)
+        self.assertAlmostEqual(30, limiter.reserve(), places=1)
+        self.assertEqual(1, limiter.stats["throttled"])
+        self.assertEqual(0, limiter.stats["tokens"])
+
+    @patch("djasana.connect.time.sleep")
+    @patch.object(AsanaClient, "request")
+    def test_request_retries_after_rate_limit(self, mock_request, mock_sleep):
+        mock_request.side_effect = [rate_limit_error(2), {"gid": "1"}]
+        client = Client()
+        client.rate_limiter = RateLimiter(requests_per_minute=60)
+        self.assertEqual({"gid": "1"}, client.request("get", "/tasks/1"))
+        self.assertEqual(2, mock_request.call_count)
+        self.assertEqual(0, mock_request.call_args[1]["max_retries"])
+        self.assertAlmostEqual(2, mock_sleep.call_args[0][0], places=1)
+        self.assertEqual(1, client.rate_limiter.stats["throttled"])
+
+    @patch("djasana.connect.time.sleep")
+    @patch.object(AsanaClient, "request")
+    def test_request_gives_up(self, mock_request, _):
+        mock_request.side_effect = rate_limit_error(1)
+        client = Client(max_retries=2)
+        with self.assertRaises(RateLimitEnforcedError):
+            client.request("get", "/tasks/1")
+        self.assertEqual(3, mock_request.call_count)
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock(rate_limiter=None)
+
+        def post(path, data):
+            return [
+                {"status_code": 200, "body": {"data": {"gid": action["relative_path"]}}}
+                if action["relative_path"] != "/tasks/404"
+                else {"status_code": 404, "body": {"errors": [{"message": "gone"}]}}
+                for action in data["actions"]
+            ]
+
+        self.client.post.side_effect = post
+
+    def test_sends_ten_reads_per_request(self):
+        with Batch(self.client) as batch:
+            futures = [batch.get(f"/tasks/{gid}") for gid in range(12)]
+            self.assertEqual(1, self.client.post.call_count)
+        self.assertEqual(2, self.client.post.call_count)
+        self.assertEqual("/tasks/11", futures[11].result()["gid"])
+        self.assertEqual("/batch", self.client.post.call_args[0][0])
+
+    def test_result_sends_pending_reads(self):
+        batch = Batch(self.client)
+        future = batch.get("/stories/1", fields=["text"])
+        self.assertEqual({"gid": "/stories/1"}, future.result())
+        action = self.client.post.call_args[0][1]["actions"][0]
+        self.assertEqual({"fields": ["text"]}, action["options"])
+
+    def test_failed_read(self):
+        with Batch(self.client) as batch:
+            missing = batch.get("/tasks/404")
+            found = batch.get("/tasks/1")
+        self.assertIsInstance(missing.exception(), NotFoundError)
+        self.assertEqual({"gid": "/tasks/1"}, found.result())
+
+
+class PrefetchingPageIteratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = Client.access_token("foo")
+        self.pages = {
+            None: {"data": [1, 2], "next_page": {"offset": "a"}},
+            "a": {"data": [3, 4], "next_page": {"offset": "b"}},
+            "b": {"data": [5], "next_page": None},
+        }
+        self.offsets = []
+
+    def get(self, path, query, **options):
+        self.offsets.append(options.get("offset"))
+        self.assertEqual(PAGE_SIZE, options["limit"])
+        return self.pages[options.get("offset")]
+
+    def test_items(self):
+        prefetched = threading.Event()
+
+        def get(path, query, **options):
+            if options.get("offset") == "a":
+                prefetched.set()
+            return self.get(path, query, **options)
+
+        with patch.object(self.client, "get", side_effect=get):
+            items = self.client.get_collection("/tasks", {})
+            self.assertEqual(1, next(items))
+            # The second page is requested before the first one is used up.
+            self.assertTrue(prefetched.wait(timeout=5))
+            self.assertEqual([2, 3, 4, 5], list(items))
+        self.assertEqual([None, "a", "b"], self.offsets)
+
+    @patch("djasana.connect.time.sleep")
+    def test_resumes_at_offset(self, sleep):
+        calls = []
+
+        def request(method, path, **options):
+            offset = options["params"].get("offset")
+            calls.append(offset)
+            if calls.count("b") == 1 and offset == "b":
+                raise ChunkedEncodingError()
+            return self.pages[offset]
+
+        with patch.object(AsanaClient, "request", side_effect=request):
+            self.assertEqual(
+                [1, 2, 3, 4, 5], list(self.client.get_collection("/tasks", {}))
+            )
+        self.assertEqual([None, "a", "b", "b"], calls)
+        self.assertEqual(1, sleep.call_count)
+
+    def test_items_offset(self):
+        with patch.object(self.client, "get", side_effect=self.get):
+            items = self.client.get_collection("/tasks", {}, offset="a")
+            offsets = [(item, items.offset) for item in items]
+        self.assertEqual([(3, "a"), (4, "a"), (5, "b")], offsets)
+
+    def test_item_limit(self):
+        limits = []
+
+        def get(path, query, **options):
+            limits.append(options["limit"])
+            return self.pages[options.get("offset")]
+
+        with patch.object(self.client, "get", side_effect=get):
+            list(self.client.get_collection("/tasks", {}, item_limit=3))
+        self.assertEqual([3, 1], limits)
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class AsyncClientTestCase(unittest.TestCase):
+    def get_client(self, responses):
+        responses = iter(responses)
+        return AsyncClient(
+            "foo",
+            rate_limiter=RateLimiter(),
+            transport=httpx.MockTransport(lambda request: next(responses)),
+        )
+
+    @override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None)
+    @patch("djasana.connect.Client")
+    def test_rate_limiter_is_shared_with_client_connect(self, mock_client):
+        mock_client.access_token.side_effect = lambda token: Mock(options={})
+        async_client = async_client_connect()
+        self.assertIsNotNone(async_client.rate_limiter)
+        self.assertIs(client_connect().rate_limiter, async_client.rate_limiter)
+        asyncio.run(async_client.aclose())
+
+    def test_retries_after_rate_limit(self):
+        client = self.get_client(
+            [
+                httpx.Response(429, headers={"Retry-After": "0.01"}, json={}),
+                httpx.Response(200, json={"data": {"gid": "1"}}),
+            ]
+        )
+        self.assertEqual({"gid": "1"}, asyncio.run(client.get("/tasks/1")))
+        self.assertEqual(1, client.rate_limiter.throttled)
+
+    def test_not_found(self):
+        client = self.get_client(
+            [httpx.Response(404, json={"errors": [{"message": "gone"}]})]
+        )
+        with self.assertRaises(NotFoundError):
+            asyncio.run(client.get("/tasks/1"))
+
+    def test_collection(self):
+        client = self.get_client(
+            [
+                httpx.Response(
+                    200, json={"data": [1, 2], "next_page": {"offset": "a"}}
+                ),
+                httpx.Response(200, json={"data": [3], "next_page": None}),
+            ]
+        )
+
+        async def collect():
+            return [item async for item in client.get_collection("/tasks")]
+
+        self.assertEqual([1, 2, 3], asyncio.run(collect()))
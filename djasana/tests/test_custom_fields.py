@@ -0,0 +1,41 @@
+from unittest.mock import MagicMock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from djasana.custom_fields import CustomFieldCache
+
+
+def definition(gid, name):
+    return {"gid": gid, "name": name, "resource_subtype": "text"}
+
+
+class CustomFieldCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = MagicMock()
+        self.client.custom_fields.find_by_workspace.return_value = [
+            definition("1", "Priority"),
+            definition("2", "Effort"),
+        ]
+
+    def test_workspace_is_listed_once(self):
+        custom_fields = CustomFieldCache(self.client, timeout=0)
+        self.assertEqual("Priority", custom_fields.get(1, "1")["name"])
+        self.assertEqual("Effort", custom_fields.get("1", 2)["name"])
+        self.assertEqual(1, self.client.custom_fields.find_by_workspace.call_count)
+        self.assertFalse(self.client.custom_fields.find_by_id.called)
+        self.assertIsNone(cache.get("djasana:custom_fields:1"))
+
+    def test_new_field_is_read(self):
+        self.client.custom_fields.find_by_id.return_value = definition("3", "New")
+        custom_fields = CustomFieldCache(self.client, timeout=0)
+        self.assertEqual("New", custom_fields.get(1, "3")["name"])
+        custom_fields.get(1, "3")
+        self.assertEqual(1, self.client.custom_fields.find_by_id.call_count)
+
+    @override_settings(DJASANA_CUSTOM_FIELD_CACHE_TIMEOUT=60)
+    def test_definitions_outlive_the_run(self):
+        CustomFieldCache(self.client).get(1, "1")
+        custom_fields = CustomFieldCache(self.client)
+        self.assertEqual("Effort", custom_fields.get(1, "2")["name"])
+        self.assertEqual(1, self.client.custom_fields.find_by_workspace.call_count)
@@ -0,0 +1,75 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import override_settings, TestCase
+from djasana.events import apply_event, decompress, log_events
+from djasana.models import Event, Project, Task, Team, Workspace
+from djasana.tests.fixtures import mock_batch, task
+
+
+def event(gid, action="changed", **kwargs):
+    return dict(
+        action=action,
+        created_at="2017-08-21T18:20:37.972Z",
+        resource={"gid": gid, "resource_type": "task"},
+        **kwargs
+    )
+
+
+@override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None)
+class EventLogTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        workspace = Workspace.objects.create(remote_id=1, name="Workspace")
+        team = Team.objects.create(remote_id=2, name="Team")
+        cls.project = Project.objects.create(
+            remote_id=3, name="Project", public=True, team=team, workspace=workspace
+        )
+
+    def setUp(self):
+        for gid in (10, 11, 12):
+            Task.objects.create(remote_id=gid, name=f"Task {gid}")
+
+    def test_events_are_logged_compressed(self):
+        events = [event("10"), dict(event("11", "removed"), type="task")]
+        with self.assertNumQueries(1):
+            log_events(events, 3)
+        logged = Event.objects.order_by("pk")
+        self.assertEqual(
+            [("10", "changed", "task"), ("11", "removed", "task")],
+            [(row.gid, row.action, row.resource_type) for row in logged],
+        )
+        self.assertEqual(events[1], decompress(logged[1].payload))
+        self.assertEqual(2017, logged[0].created_at.year)
+
+    def test_apply_event(self):
+        renamed = event("10", change={"field": "name", "new_value": "Renamed"})
+        self.assertTrue(apply_event(renamed))
+        self.assertEqual("Renamed", Task.objects.get(remote_id=10).name)
+        self.assertTrue(apply_event(event("11", "deleted")))
+        self.assertFalse(Task.objects.filter(remote_id=11).exists())
+        self.assertFalse(apply_event(event("12")))
+        followers = event("12", change={"field": "followers", "new_value": []})
+        self.assertFalse(apply_event(followers))
+
+    @patch("djasana.connect.Client")
+    def test_replay(self, mock_client):
+        log_events(
+            [
+                event("10", change={"field": "name", "new_value": "Renamed"}),
+                event("11", "removed"),
+                event("12"),
+            ],
+            3,
+        )
+        stdout = StringIO()
+        call_command("replay_asana_events", offline=True, stdout=stdout)
+        self.assertIn("Applied 2 events from the log, 0 by", stdout.getvalue())
+        self.assertEqual("Renamed", Task.objects.get(remote_id=10).name)
+        self.assertFalse(mock_client.access_token.called)
+        mock_client.access_token().tasks.find_by_id.return_value = task(name="Read")
+        mock_batch(mock_client.access_token())
+        call_command("replay_asana_events", "--since=2017-08-21", verbosity=0)
+        self.assertEqual("Read", Task.objects.get(remote_id=12).name)
+        self.assertEqual(3, Event.objects.count())
@@ -0,0 +1,37 @@
+from django.test import TestCase
+from djasana.identity import IdentityMap
+from djasana.models import Tag, Task, User, Workspace
+
+
+class IdentityMapTestCase(TestCase):
+    def test_prefill(self):
+        user = User.objects.create(remote_id=1, gid="1", name="Test User")
+        Workspace.objects.create(remote_id=1, gid="1", name="Test")
+        identity = IdentityMap()
+        with self.assertNumQueries(4):
+            identity.prefill()
+        self.assertEqual(user.pk, identity.get(User, "1"))
+        self.assertFalse(identity.known(Tag, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        identity = IdentityMap(maxsize=2)
+        identity.add(User, 1, 10)
+        identity.add(User, 2)
+        self.assertTrue(identity.known(User, 1))
+        identity.add(User, 3, 30)
+        self.assertTrue(identity.known(User, 1))
+        self.assertFalse(identity.known(User, 2))
+        self.assertIsNone(identity.get(User, 4))
+
+    def test_pk_is_kept(self):
+        identity = IdentityMap()
+        identity.add(User, 1, 10)
+        identity.add(User, 1)
+        self.assertEqual(10, identity.get(User, 1))
+        identity.discard(User, 1)
+        self.assertFalse(identity.known(User, 1))
+
+    def test_untracked_models(self):
+        identity = IdentityMap()
+        identity.add(Task, 1, 10)
+        self.assertFalse(identity.known(Task, 1))
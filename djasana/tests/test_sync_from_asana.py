@@ -259,7 +259,7 @@ class SyncFromAsanaTestCase(TestCase):
 
     def test_subtask(self):
         """Asserts subtask (task related to a task but not a project) is supported."""
-        parent_task = task(projects=None)  # Parent is also a subtask
+        parent_task = task(projects=None, num_subtasks=1)  # Parent is also a subtask
         subtask = task(gid="2", projects=None, parent=parent_task.copy())
 
         self.command.client.tasks.find_all.return_value = [parent_task.copy()]
@@ -308,14 +308,14 @@ class SyncFromAsanaTestCase(TestCase):
         project_dict = project(gid="3")
         self.command.client.projects.find_all.return_value = [project_dict]
         self.command.client.projects.find_by_id.return_value = project_dict
-        webhook_ = webhook(project=project_dict)
+        webhook_ = webhook(resource=project_dict)
         self.command.client.webhooks.get_all.return_value = [webhook_, webhook_]
         self.command.handle(interactive=False, project=["Test Project"])
         self.assertEqual(2, self.command.client.webhooks.delete_by_id.call_count)
         self.assertEqual(1, Webhook.objects.filter(project=project_).count())
 
     def test_subtasks_synced(self):
-        parent_task = task()
+        parent_task = task(num_subtasks=1)
         child_task = task(gid="99", name="Subtask", parent=task())
         # When processed, tasks get modified in place;
         # we need to pass the original twice.
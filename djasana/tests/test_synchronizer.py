@@ -0,0 +1,628 @@
+import sys
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+from django.core.exceptions import FieldDoesNotExist
+from django.test import override_settings, TestCase
+from django.utils import timezone
+from djasana.bulk import BulkWriter
+from djasana.connect import PageItems
+from djasana.models import (
+    Attachment,
+    CustomField,
+    CustomFieldSetting,
+    Project,
+    Story,
+    SyncCheckpoint,
+    SyncMark,
+    Task,
+    User,
+    Webhook,
+    Workspace,
+)
+from djasana.synchronizer import AsanaSynchronizer, newer_stories, shard_projects
+from djasana.tests.fixtures import (
+    attachment,
+    custom_field,
+    mock_batch,
+    project,
+    story,
+    task,
+    user,
+    webhook,
+    workspace,
+)
+from djasana.utils import get_opt_fields
+
+
+class InlineExecutor(object):
+    """Stands in for ProcessPoolExecutor, running work in this process"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+class Pages(object):
+    """Stands in for PrefetchingPageIterator, serving (offset, page) pairs
+
+    A page that is an exception is raised instead, as a dropped connection is.
+    """
+
+    def __init__(self, pages):
+        self._pages = iter(pages)
+        self.offset = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.offset, page = next(self._pages)
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+
+def complete(model, record):
+    """Returns record as a list call with the opt_fields of model returns it"""
+    fields = {}
+    for opt_field in get_opt_fields(model):
+        name = opt_field.split(".")[0]
+        try:
+            fields[name] = model._meta.get_field(name).get_default()
+        except FieldDoesNotExist:
+            fields[name] = None
+    fields.update(record)
+    return fields
+
+
+@override_settings(
+    ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE=None, ROOT_URLCONF="djasana.urls"
+)
+class AsanaSynchronizerTestCase(TestCase):
+    """Tests of AsanaSynchronizer that use mock returns from Asana"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.workspaces.find_all.return_value = [workspace()]
+        self.client.workspaces.find_by_id.return_value = workspace()
+        self.client.projects.find_all.return_value = [project()]
+        self.client.projects.find_by_id.return_value = project()
+        self.client.tasks.find_all.return_value = [task()]
+        self.client.tasks.find_by_id.side_effect = task
+        self.client.tasks.subtasks.return_value = []
+        mock_batch(self.client)
+        patcher = patch("djasana.synchronizer.client_connect", return_value=self.client)
+        self.client_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_synchronizer(self, **kwargs):
+        kwargs.setdefault("workspaces", [])
+        kwargs.setdefault("projects", [])
+        return AsanaSynchronizer(**kwargs)
+
+    def test_good_sync(self):
+        self.client.attachments.find_by_task.return_value = [attachment()]
+        self.client.attachments.find_by_id.return_value = attachment()
+        self.client.stories.find_by_task.return_value = [story()]
+        self.client.stories.find_by_id.return_value = story()
+        self.get_synchronizer().run_sync()
+        self.assertEqual(1, Workspace.objects.count())
+        self.assertEqual(1, Project.objects.count())
+        self.assertEqual(1, Task.objects.count())
+        self.assertEqual(1, User.objects.count())
+        self.assertEqual(1, Attachment.objects.count())
+        self.assertEqual(1, Story.objects.count())
+
+    def test_pooled_client_is_not_used(self):
+        """The sync changes its client's options, which others must not see"""
+        self.get_synchronizer(max_workers=2, workspaces=["1"])
+        self.client_connect.assert_called_once_with(pooled=False)
+
+    def test_concurrent_sync(self):
+        tasks = [task(gid=str(gid), name=f"Task {gid}") for gid in range(1, 21)]
+        self.client.tasks.find_all.return_value = tasks
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(
+            gid=gid, name=f"Task {gid}"
+        )
+        self.client.stories.find_by_task.side_effect = lambda gid, **_: [
+            story(gid=gid, target=task(gid=gid))
+        ]
+        self.client.stories.find_by_id.side_effect = lambda gid: story(
+            gid=gid, target=task(gid=gid)
+        )
+        synchronizer = self.get_synchronizer(max_workers=4)
+        synchronizer.run_sync()
+        self.assertEqual(20, Task.objects.count())
+        self.assertEqual(20, Story.objects.count())
+        self.assertEqual({task_["gid"] for task_ in tasks}, synchronizer.synced_ids)
+        self.assertIsNone(synchronizer._executor)
+
+    def test_concurrent_sync_keeps_parent_first(self):
+        parent_task = task(gid="1", name="Parent")
+        child_task = task(gid="2", name="Child", parent=task(gid="1"))
+        payloads = {"1": parent_task, "2": child_task}
+        self.client.tasks.find_all.return_value = [task(gid="2")]
+        self.client.tasks.find_by_id.side_effect = lambda gid: payloads[gid].copy()
+        synchronizer = self.get_synchronizer(max_workers=4)
+        synchronizer.run_sync()
+        self.assertEqual({"1", "2"}, synchronizer.synced_ids)
+        child = Task.objects.get(remote_id=2)
+        self.assertEqual(1, child.parent.remote_id)
+
+    def test_deep_subtask_tree(self):
+        depth = sys.getrecursionlimit() + 10
+
+        def find_by_id(gid):
+            parent = task(gid=str(int(gid) - 1)) if gid != "1" else None
+            return task(gid=gid, num_subtasks=int(int(gid) < depth), parent=parent)
+
+        self.client.tasks.find_by_id.side_effect = find_by_id
+        self.client.tasks.subtasks.side_effect = lambda gid, **_: [
+            task(gid=str(int(gid) + 1))
+        ]
+        self.get_synchronizer().run_sync()
+        self.assertEqual(depth, Task.objects.count())
+        self.assertEqual(depth - 1, self.client.tasks.subtasks.call_count)
+        self.assertEqual(depth - 1, Task.objects.get(remote_id=depth).parent.remote_id)
+
+    def test_parents_and_dependencies_are_linked_last(self):
+        records = {
+            "1": task(gid="1", name="Parent", num_subtasks=1),
+            "2": task(gid="2", parent=task(gid="1"), dependencies=[task(gid="3")]),
+            "3": task(gid="3", name="Dependency"),
+        }
+        self.client.tasks.find_all.return_value = [task(gid="2")]
+        self.client.tasks.find_by_id.side_effect = lambda gid: records[gid].copy()
+        self.get_synchronizer().run_sync()
+        child = Task.objects.get(remote_id=2)
+        self.assertEqual(1, child.parent.remote_id)
+        self.assertEqual(
+            [3], list(child.dependencies.values_list("remote_id", flat=True))
+        )
+        # The parent is synced without its subtasks; the others have none.
+        self.assertFalse(self.client.tasks.subtasks.called)
+
+    def test_unchanged_tasks_are_skipped(self):
+        modified_at = timezone.now() - timedelta(days=1)
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_all.side_effect = lambda *_, **__: [
+            task(modified_at=modified_at)
+        ]
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(
+            gid=gid, modified_at=modified_at
+        )
+        self.client.stories.find_by_task.side_effect = lambda gid, **_: [story()]
+        self.client.stories.find_by_id.side_effect = lambda gid: story()
+        self.get_synchronizer().run_sync()
+        self.assertEqual(modified_at, Task.objects.get(remote_id=1).modified_at)
+        self.client.reset_mock()
+        synchronizer = self.get_synchronizer()
+        synchronizer.run_sync()
+        self.assertFalse(self.client.tasks.find_by_id.called)
+        self.assertFalse(self.client.attachments.find_by_task.called)
+        self.assertFalse(self.client.stories.find_by_task.called)
+        self.assertEqual(1, synchronizer.stats["tasks_unchanged"])
+        self.assertEqual(0, synchronizer.stats["tasks_fetched"])
+        self.assertEqual(
+            synchronizer.generation, Task.objects.get(remote_id=1).sync_generation
+        )
+        modified_at = timezone.now()
+        synchronizer = self.get_synchronizer()
+        synchronizer.run_sync()
+        self.assertEqual(1, synchronizer.stats["tasks_fetched"])
+        self.assertTrue(self.client.stories.find_by_task.called)
+
+    def test_tasks_synced_without_stories_are_not_skipped(self):
+        modified_at = timezone.now() - timedelta(days=1)
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_all.side_effect = lambda *_, **__: [
+            task(modified_at=modified_at)
+        ]
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(
+            gid=gid, modified_at=modified_at
+        )
+        self.client.stories.find_by_task.side_effect = lambda gid, **_: [story()]
+        self.client.stories.find_by_id.side_effect = lambda gid: story()
+        self.get_synchronizer(exclude_models=["Story"]).run_sync()
+        self.assertFalse(self.client.stories.find_by_task.called)
+        self.assertIsNone(Task.objects.get(remote_id=1).synced_modified_at)
+        synchronizer = self.get_synchronizer()
+        synchronizer.run_sync()
+        self.assertEqual(0, synchronizer.stats["tasks_unchanged"])
+        self.assertEqual(1, Story.objects.count())
+        self.assertEqual(modified_at, Task.objects.get(remote_id=1).synced_modified_at)
+
+    def test_newer_stories(self):
+        now = timezone.now()
+        stories = [
+            (None, story(gid="1", created_at=now - timedelta(hours=2))),
+            ("b", story(gid="2", created_at=now - timedelta(hours=1))),
+            ("b", story(gid="3", created_at=now.isoformat())),
+        ]
+        picked, watermark = newer_stories(stories, ("a", now - timedelta(hours=1)))
+        self.assertEqual(["2", "3"], [story_["gid"] for story_ in picked])
+        self.assertEqual(("b", now), watermark)
+        self.assertEqual((None, None), newer_stories([])[1])
+
+    def test_stories_are_read_from_watermark(self):
+        created_at = timezone.now() - timedelta(days=1)
+        stories = {
+            gid: complete(
+                Story,
+                story(gid=gid, created_at=created_at + timedelta(hours=int(gid))),
+            )
+            for gid in ("1", "2", "3")
+        }
+        pages = {
+            None: [(None, [stories["1"]]), ("b", [stories["2"]])],
+            "b": [("b", [stories["2"], stories["3"]])],
+        }
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_all.side_effect = lambda *_, **__: [
+            task(modified_at=timezone.now())
+        ]
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        self.client.stories.find_by_task.side_effect = lambda gid, **options: (
+            PageItems(Pages(pages[options.get("offset")]))
+        )
+        self.get_synchronizer().run_sync()
+        self.assertEqual(2, Story.objects.count())
+        self.assertEqual("b", Task.objects.get(remote_id=1).last_story_offset)
+        self.get_synchronizer().run_sync()
+        self.assertEqual("b", self.client.stories.find_by_task.call_args[1]["offset"])
+        self.assertEqual(3, Story.objects.count())
+        self.assertEqual(
+            created_at + timedelta(hours=3),
+            Task.objects.get(remote_id=1).last_story_at,
+        )
+
+    def test_complete_list_records_are_not_fetched_again(self):
+        self.client.tasks.find_all.return_value = [complete(Task, task())]
+        self.client.users.find_all.return_value = [
+            complete(User, user(photo=None, email="test@example.com"))
+        ]
+        self.client.stories.find_by_task.return_value = [complete(Story, story())]
+        self.get_synchronizer().run_sync()
+        self.assertEqual(1, Task.objects.count())
+        self.assertEqual(1, Story.objects.count())
+        self.assertEqual(
+            "test@example.com", User.objects.get(remote_id=1).email
+        )
+        self.assertFalse(self.client.tasks.find_by_id.called)
+        self.assertFalse(self.client.users.find_by_id.called)
+        self.assertFalse(self.client.stories.find_by_id.called)
+        self.assertEqual(
+            get_opt_fields(Task), self.client.tasks.find_all.call_args[1]["fields"]
+        )
+
+    def test_known_references_are_not_written_again(self):
+        User.objects.create(remote_id=1, gid="1", name="Test User")
+        tasks = [task(gid=str(gid), name=f"Task {gid}") for gid in range(1, 4)]
+        self.client.tasks.find_all.return_value = tasks
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        synchronizer = self.get_synchronizer()
+        with patch.object(
+            BulkWriter, "_insert", autospec=True, side_effect=BulkWriter._insert
+        ) as insert:
+            synchronizer.run_sync()
+        self.assertNotIn(User, [call[0][1] for call in insert.call_args_list])
+        self.assertEqual(3, Task.objects.filter(assignee_id=1).count())
+        self.assertGreater(synchronizer.identity.hits, 0)
+
+    def test_incomplete_records_are_read_in_batches(self):
+        self.client.stories.find_by_task.return_value = [
+            story(gid=str(gid)) for gid in range(1, 13)
+        ]
+        self.client.stories.find_by_id.side_effect = lambda gid: story(gid=gid)
+        self.get_synchronizer().run_sync()
+        self.assertEqual(12, Story.objects.count())
+        batches = [
+            call for call in self.client.post.call_args_list if call[0][0] == "/batch"
+        ]
+        # The task itself, then twelve stories.
+        self.assertEqual([1, 10, 2], [len(call[0][1]["actions"]) for call in batches])
+
+    def test_incremental_sync(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project()
+        self.get_synchronizer(incremental=True).run_sync()
+        mark = SyncMark.objects.get(workspace_id=1)
+        self.assertFalse(self.client.tasks.search_in_workspace.called)
+
+        modified_at = timezone.now()
+        self.client.tasks.search_in_workspace.return_value = [
+            complete(Task, task(gid="2", name="Changed", modified_at=modified_at))
+        ]
+        self.client.projects.find_by_id.reset_mock()
+        self.get_synchronizer(incremental=True).run_sync()
+        params = self.client.tasks.search_in_workspace.call_args[0][1]
+        self.assertEqual(mark.synced_at.isoformat(), params["modified_at.after"])
+        self.assertFalse(self.client.projects.find_by_id.called)
+        changed = Task.objects.get(remote_id=2)
+        self.assertEqual("Changed", changed.name)
+        projects = changed.projects.values_list("remote_id", flat=True)
+        self.assertEqual([1], list(projects))
+        self.assertLess(mark.synced_at, SyncMark.objects.get(workspace_id=1).synced_at)
+
+    def test_search_is_repeated_for_full_pages(self):
+        start = timezone.now()
+        pages = [
+            [
+                complete(
+                    Task,
+                    task(gid=str(gid), modified_at=(start + timedelta(seconds=gid))),
+                )
+                for gid in range(first, last)
+            ]
+            for first, last in ((1, 101), (100, 130))
+        ]
+        for page in pages:
+            for task_ in page:
+                task_["modified_at"] = task_["modified_at"].isoformat()
+        self.client.tasks.search_in_workspace.side_effect = pages
+        self.get_synchronizer(since=start).run_sync()
+        self.assertEqual(129, Task.objects.count())
+        second_search = self.client.tasks.search_in_workspace.call_args_list[1][0][1]
+        self.assertLess(
+            second_search["modified_at.after"], pages[0][-1]["modified_at"]
+        )
+        self.assertFalse(SyncMark.objects.exists())
+
+    def test_events_are_coalesced(self):
+        synchronizer = self.get_synchronizer()
+        synchronizer.run_sync()
+        self.client.reset_mock()
+        self.client.projects.find_by_id.return_value = project(name="Renamed")
+        self.client.tasks.find_by_id.side_effect = lambda gid: complete(
+            Task, task(gid=gid)
+        )
+        events = [
+            {"type": "task", "action": "changed", "resource": task(gid="2")},
+            {"type": "project", "action": "changed", "resource": project()},
+            {"type": "task", "action": "changed", "resource": task(gid="2")},
+            {"type": "task", "action": "removed", "resource": task(gid="1")},
+        ]
+        synchronizer._process_events("1", {"data": events}, [Project, Task])
+        self.assertEqual(1, self.client.tasks.find_by_id.call_count)
+        self.assertFalse(self.client.tasks.find_all.called)
+        self.assertEqual("Renamed", Project.objects.get(remote_id=1).name)
+        self.assertEqual([2], list(Task.objects.values_list("remote_id", flat=True)))
+
+    def test_shard_projects(self):
+        sizes = {"1": 100, "2": 60, "3": 50, "4": 10}
+        shards = shard_projects(["1", "2", "3", "4", "5"], sizes, 2)
+        self.assertEqual([["1", "3"], ["2", "5", "4"]], shards)
+        self.assertEqual([["1"]], shard_projects(["1"], {}, 4))
+
+    @patch("djasana.synchronizer.ProcessPoolExecutor", InlineExecutor)
+    def test_processes(self):
+        self.client.projects.find_all.return_value = [
+            project(gid=str(gid), name=f"Project {gid}") for gid in range(1, 4)
+        ]
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_all.side_effect = lambda params, **_: [
+            task(gid=params["project"])
+        ]
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        synchronizer = self.get_synchronizer(processes=2)
+        synchronizer.run_sync()
+        self.assertEqual(3, Project.objects.count())
+        self.assertEqual(3, Task.objects.count())
+        self.assertEqual(3, synchronizer.stats["projects"])
+        self.assertEqual(3, synchronizer.stats["tasks"])
+        self.assertEqual([], synchronizer.errors)
+
+    @patch("djasana.synchronizer.ProcessPoolExecutor", InlineExecutor)
+    def test_processes_report_errors(self):
+        self.client.projects.find_all.return_value = [
+            project(gid=str(gid), name=f"Project {gid}") for gid in range(1, 4)
+        ]
+        self.client.projects.find_by_id.side_effect = lambda gid: (
+            project(gid=gid) if gid != "2" else 1 / 0
+        )
+        synchronizer = self.get_synchronizer(processes=3)
+        with self.assertRaises(RuntimeError):
+            synchronizer.run_sync()
+        self.assertEqual(2, synchronizer.stats["projects"])
+        self.assertEqual(["2"], [project_id for project_id, _ in synchronizer.errors])
+
+    def test_resume_skips_finished_projects(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_all.return_value = [
+            project(gid=str(gid), name=f"Project {gid}") for gid in range(1, 4)
+        ]
+        self.client.projects.find_by_id.side_effect = lambda gid: (
+            project(gid=gid) if gid != "2" else 1 / 0
+        )
+        self.client.tasks.find_all.side_effect = lambda params, **_: [
+            task(gid=params["project"])
+        ]
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        with self.assertRaises(ZeroDivisionError):
+            self.get_synchronizer().run_sync()
+        # Newer projects are synced first.
+        self.assertTrue(SyncCheckpoint.objects.get(project_id=3).finished)
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_all.reset_mock()
+        self.get_synchronizer(resume=True).run_sync()
+        synced = [
+            call[0][0]["project"] for call in self.client.tasks.find_all.call_args_list
+        ]
+        self.assertEqual(["2", "1"], synced)
+        self.assertEqual(3, Task.objects.count())
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+    def test_checkpoints_of_other_runs_are_kept(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.get_synchronizer().run_sync()
+        other = Project.objects.create(
+            remote_id=2,
+            gid="2",
+            name="Other Project",
+            workspace=Workspace.objects.get(),
+        )
+        SyncCheckpoint.objects.create(project=other, generation=7, offset="c")
+        SyncCheckpoint.objects.create(project_id=1, generation=7, offset="b")
+        self.get_synchronizer().run_sync()
+        # The interrupted project was synced from the start, not from offset "b".
+        self.assertNotIn("offset", self.client.tasks.find_all.call_args[1])
+        self.assertEqual(
+            [(2, 7, "c")],
+            list(
+                SyncCheckpoint.objects.values_list("project_id", "generation", "offset")
+            ),
+        )
+
+    def test_resume_from_offset(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        pages = [
+            (None, [task(gid=str(gid)) for gid in range(1, 11)]),
+            ("b", [task(gid=str(gid)) for gid in range(11, 21)]),
+            ("c", ConnectionError("Connection reset")),
+        ]
+        self.client.tasks.find_all.side_effect = lambda *_, **__: PageItems(
+            Pages(pages)
+        )
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        with self.assertRaises(ConnectionError):
+            self.get_synchronizer().run_sync()
+        self.assertEqual("b", SyncCheckpoint.objects.get(project_id=1).offset)
+        self.assertEqual(10, Task.objects.count())
+        Task.objects.create(remote_id=99, gid="99", name="Stale").projects.add(
+            Project.objects.get(remote_id=1)
+        )
+        self.client.tasks.find_all.side_effect = lambda *_, **__: pages[1][1]
+        self.get_synchronizer(resume=True).run_sync()
+        self.assertEqual("b", self.client.tasks.find_all.call_args[1]["offset"])
+        # Tasks synced before the interruption are not taken to be stale.
+        self.assertEqual(20, Task.objects.count())
+        self.assertFalse(Task.objects.filter(remote_id=99).exists())
+
+    @patch("djasana.synchronizer.DELETE_BATCH_SIZE", 2)
+    def test_stale_tasks_are_deleted(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        self.get_synchronizer().run_sync()
+        project_ = Project.objects.get(remote_id=1)
+        for gid in range(2, 7):
+            Task.objects.create(
+                remote_id=gid, gid=str(gid), name="Stale", sync_generation=1
+            ).projects.add(project_)
+        Task.objects.create(remote_id=7, gid="7", name="Elsewhere", sync_generation=1)
+        synchronizer = self.get_synchronizer()
+        with self.assertLogs("djasana.synchronizer", "INFO") as logs:
+            synchronizer.run_sync()
+        self.assertEqual(2, synchronizer.generation)
+        self.assertEqual(
+            {1: 2, 7: 1}, dict(Task.objects.values_list("remote_id", "sync_generation"))
+        )
+        self.assertIn(
+            "INFO:djasana.synchronizer:Deleted 5 tasks no longer present in project "
+            "Test Project.",
+            logs.output,
+        )
+
+    @patch("djasana.synchronizer.SEARCH_PAGE_SIZE", 2)
+    def test_search_of_tasks_modified_at_once_falls_back(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        modified_at = timezone.now().isoformat()
+        self.client.tasks.search_in_workspace.return_value = [
+            complete(Task, task(gid=gid, modified_at=modified_at))
+            for gid in ("2", "3")
+        ]
+        with self.assertLogs("djasana.synchronizer", "WARNING") as logs:
+            self.get_synchronizer(since=timezone.now()).run_sync()
+        self.assertEqual(2, self.client.tasks.search_in_workspace.call_count)
+        self.assertIn("syncing it in full", logs.output[0])
+        self.assertTrue(self.client.tasks.find_all.called)
+        self.assertTrue(Task.objects.filter(remote_id=1).exists())
+
+    @override_settings(DJASANA_CUSTOM_FIELD_CACHE_TIMEOUT=0)
+    def test_custom_fields_are_read_once(self):
+        def project_with_settings(gid):
+            custom_field_settings = [
+                {
+                    "gid": f"{gid}00",
+                    "custom_field": {"gid": "1", "name": "Test Custom Field"},
+                    "project": {"gid": gid, "name": "Test Project"},
+                }
+            ]
+            return project(gid=gid, custom_field_settings=custom_field_settings)
+
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_all.return_value = [
+            project(gid="1"),
+            project(gid="2"),
+        ]
+        self.client.projects.find_by_id.side_effect = project_with_settings
+        self.client.custom_fields.find_by_workspace.return_value = [
+            dict(custom_field(created_by=dict(user())))
+        ]
+        self.get_synchronizer().run_sync()
+        self.assertEqual(1, self.client.custom_fields.find_by_workspace.call_count)
+        self.assertFalse(self.client.custom_fields.find_by_id.called)
+        self.assertEqual("Test Custom Field", CustomField.objects.get().name)
+        self.assertEqual(
+            {(100, 1), (200, 2)},
+            set(CustomFieldSetting.objects.values_list("remote_id", "project_id")),
+        )
+
+    @override_settings(DJASANA_WEBHOOK_URL="https://example.com/hooks/")
+    def test_webhooks_are_listed_once_per_workspace(self):
+        self.client.workspaces.find_by_id.side_effect = lambda gid: workspace()
+        self.client.projects.find_all.return_value = [
+            project(gid="1"),
+            project(gid="2"),
+            project(gid="3"),
+        ]
+        self.client.projects.find_by_id.side_effect = lambda gid: project(gid=gid)
+        self.get_synchronizer().run_sync()
+        for gid in ("1", "2"):
+            Webhook.objects.create(secret="x" * 32, project_id=gid)
+        self.client.webhooks.reset_mock()
+        self.client.webhooks.get_all.return_value = [
+            webhook(gid="1", resource=project(gid="1")),
+            webhook(gid="2", resource=project(gid="2"), active=False),
+        ]
+        self.get_synchronizer().run_sync()
+        self.client.webhooks.get_all.assert_called_once_with({"workspace": "1"})
+        self.client.webhooks.delete_by_id.assert_called_once_with("2")
+        self.assertEqual(
+            ["2", "3"],
+            sorted(
+                call.args[0]["resource"]
+                for call in self.client.webhooks.create.call_args_list
+            ),
+        )
+
+    def test_project_names_are_resolved_from_one_listing(self):
+        self.client.projects.find_all.return_value = iter(
+            [project(gid="1", name="One"), project(gid="2", name="Two")]
+        )
+        synchronizer = self.get_synchronizer()
+        self.assertEqual(["2", "1"], synchronizer._get_project_ids(["One", "2"], "1"))
+        with self.assertRaisesRegex(ValueError, "Three is not an Asana project"):
+            synchronizer._get_project_ids(["Three"], "1")
+        self.assertEqual(1, self.client.projects.find_all.call_count)
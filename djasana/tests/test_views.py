@@ -1,13 +1,24 @@
 import json
+from datetime import timedelta
 from unittest.mock import patch
 
 from asana.error import ForbiddenError
+from django.core.cache import cache
+from django.core.management import call_command
 from django.http import Http404
 from django.test import override_settings, TestCase, RequestFactory
 from django.urls import reverse
+from django.utils import timezone
 
-from djasana import models, views
-from djasana.tests.fixtures import attachment, project, story, task, user
+from djasana import models, utils, views
+from djasana.tests.fixtures import (
+    attachment,
+    mock_batch,
+    project,
+    story,
+    task,
+    user,
+)
 from djasana.utils import sign_sha256_hmac
 
 
@@ -53,11 +64,15 @@ class WebhookViewTestCase(TestCase):
             ]
         }
 
+    def setUp(self):
+        cache.clear()
+
     def _get_mock_response(self, mock_client, data):
         message = json.dumps(data)
         signature = sign_sha256_hmac(self.secret, message)
         mock_client.access_token().projects.find_by_id.return_value = project(gid="3")
         mock_client.access_token().tasks.find_by_id.return_value = task()
+        mock_batch(mock_client.access_token())
         request = self.factory.post(
             "",
             content_type="application/json",
@@ -141,6 +156,59 @@ class WebhookViewTestCase(TestCase):
         response = views.WebhookView.as_view()(request, remote_id=3)
         self.assertEqual(403, response.status_code)
 
+    def test_bad_signature_is_rejected_with_few_queries(self):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        message = json.dumps(self.data)
+        signature = sign_sha256_hmac(self.secret, message)
+
+        def post(signature):
+            request = self.factory.post(
+                "",
+                content_type="application/json",
+                data=message,
+                **{"X-Hook-Signature": signature}
+            )
+            return views.WebhookView.as_view()(request, remote_id=3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(403, post(signature[:-2]).status_code)
+        utils.get_webhook_secret(3)
+        # A mismatch reads the secret once more, in case it was rotated.
+        with self.assertNumQueries(1):
+            self.assertEqual(403, post(signature[:-1] + "x").status_code)
+        with self.assertNumQueries(1):
+            self.assertEqual(403, post("é" * 64).status_code)
+
+    @patch("djasana.connect.Client")
+    def test_stale_cached_secret_is_read_again(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        # Another process rotated the secret; this one still has the old one.
+        cache.set(utils.WEBHOOK_SECRET_KEY.format(3), "y" * 64)
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.secret, cache.get(utils.WEBHOOK_SECRET_KEY.format(3)))
+
+    def test_rotated_secret_is_used(self):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self.assertEqual(self.secret, utils.get_webhook_secret(3))
+        new_secret = "x" * 64
+        request = self.factory.post(
+            "", content_type="application/json", **{"X-Hook-Secret": new_secret}
+        )
+        views.WebhookView.as_view()(request, remote_id=3)
+        self.assertEqual(new_secret, utils.get_webhook_secret(3))
+
+    @patch("djasana.utils.cache")
+    def test_missing_secret_is_cached_briefly(self, mock_cache):
+        mock_cache.get.return_value = None
+        self.assertIsNone(utils.get_webhook_secret(3))
+        mock_cache.set.assert_called_with(
+            "djasana:webhook_secret:3", "", utils.NO_WEBHOOK_SECRET_TIMEOUT
+        )
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self.assertEqual(self.secret, utils.get_webhook_secret(3))
+        mock_cache.set.assert_called_with("djasana:webhook_secret:3", self.secret, 300)
+
     def test_bad_project_id(self):
         """Asserts a malicious endpoint posts a wrong project id"""
         request = self.factory.post(
@@ -188,6 +256,116 @@ class WebhookViewTestCase(TestCase):
         except models.Attachment.DoesNotExist:
             self.fail("Attachment not created")
 
+    @patch("djasana.connect.Client")
+    def test_events_are_coalesced(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        event = {
+            "action": "changed",
+            "parent": None,
+            "resource": {"gid": "99", "resource_type": "task"},
+        }
+        data = {"events": [event, dict(event, action="added"), event]}
+        response = self._get_mock_response(mock_client, data)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, mock_client.access_token().tasks.find_by_id.call_count)
+        self.assertTrue(models.Task.objects.filter(remote_id=99).exists())
+
+    @override_settings(DJASANA_WEBHOOK_INBOX=True)
+    @patch("djasana.connect.Client")
+    def test_events_go_to_inbox(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(mock_client.access_token().tasks.find_by_id.called)
+        delivery = models.WebhookDelivery.objects.get()
+        self.assertEqual(self.data, json.loads(delivery.payload))
+        call_command("process_asana_webhooks", verbosity=0)
+        self.assertFalse(models.WebhookDelivery.objects.exists())
+        self.assertTrue(models.Task.objects.filter(remote_id=1337).exists())
+        self.assertEqual("1337", models.Event.objects.get(project_id=3).gid)
+
+    @override_settings(DJASANA_WEBHOOK_INBOX=True)
+    @patch("djasana.connect.Client")
+    def test_failed_delivery_stays_in_inbox(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self._get_mock_response(mock_client, self.data)
+        mock_client.access_token().tasks.find_by_id.side_effect = ValueError
+        call_command("process_asana_webhooks", verbosity=0)
+        delivery = models.WebhookDelivery.objects.get()
+        self.assertEqual(1, delivery.attempts)
+        self.assertIn("ValueError", delivery.error)
+        call_command("process_asana_webhooks", verbosity=0, max_attempts=1)
+        self.assertEqual(1, models.WebhookDelivery.objects.get().attempts)
+
+    @override_settings(DJASANA_WEBHOOK_INBOX=True)
+    @patch("djasana.connect.Client")
+    def test_claimed_delivery_waits_for_its_lease(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self._get_mock_response(mock_client, self.data)
+        claimed_at = timezone.now() - timedelta(seconds=60)
+        models.WebhookDelivery.objects.update(claimed_at=claimed_at)
+        call_command("process_asana_webhooks", verbosity=0)
+        self.assertEqual(claimed_at, models.WebhookDelivery.objects.get().claimed_at)
+        self.assertFalse(mock_client.access_token().tasks.find_by_id.called)
+        call_command("process_asana_webhooks", verbosity=0, lease=30)
+        self.assertFalse(models.WebhookDelivery.objects.exists())
+        self.assertTrue(models.Task.objects.filter(remote_id=1337).exists())
+
+    @staticmethod
+    def _mock_one_bad_task(mock_client):
+        """Mocks tasks 97, 98 and 99, of which 98 fails, and returns their events"""
+
+        def find_by_id(gid):
+            if gid == "98":
+                raise ValueError("Bad task")
+            return task(gid=gid)
+
+        mock_client.access_token().tasks.find_by_id.side_effect = find_by_id
+        mock_client.access_token().attachments.find_by_task.side_effect = (
+            lambda gid: [attachment(gid=gid)]
+        )
+        mock_client.access_token().attachments.find_by_id.side_effect = (
+            lambda gid: attachment(gid=gid)
+        )
+        return [
+            {"action": "changed", "resource": {"gid": gid, "resource_type": "task"}}
+            for gid in ("97", "98", "99")
+        ]
+
+    @patch("djasana.connect.Client")
+    def test_failed_event_is_rolled_back_alone(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        events = self._mock_one_bad_task(mock_client)
+        with self.assertLogs("djasana.views", "WARNING") as logs:
+            response = self._get_mock_response(mock_client, {"events": events})
+        self.assertEqual(200, response.status_code)
+        self.assertIn("1 of 3 events of project 3 failed", logs.output[-1])
+        self.assertEqual(
+            [97, 99], list(models.Task.objects.values_list("remote_id", flat=True))
+        )
+        self.assertEqual(2, models.Attachment.objects.count())
+        self.assertEqual(3, models.Event.objects.count())
+
+    @override_settings(DJASANA_WEBHOOK_INBOX=True)
+    @patch("djasana.connect.Client")
+    def test_failed_event_stays_in_inbox_alone(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        events = self._mock_one_bad_task(mock_client)
+        self._get_mock_response(mock_client, {"events": events})
+        call_command("process_asana_webhooks", verbosity=0)
+        self.assertEqual(
+            [97, 99], list(models.Task.objects.values_list("remote_id", flat=True))
+        )
+        delivery = models.WebhookDelivery.objects.get()
+        self.assertEqual(1, delivery.attempts)
+        self.assertEqual([events[1]], json.loads(delivery.payload)["events"])
+        self.assertIn("Bad task", delivery.error)
+        mock_client.access_token().tasks.find_by_id.side_effect = None
+        call_command("process_asana_webhooks", verbosity=0)
+        self.assertFalse(models.WebhookDelivery.objects.exists())
+        self.assertEqual(3, models.Task.objects.count())
+        self.assertEqual(3, models.Event.objects.count())
+
     @patch("djasana.connect.Client")
     def test_bad_task_id(self, mock_client):
         """Asserts an event is received for a task that is now deleted in Asana"""
@@ -1,9 +1,11 @@
 import hashlib
 import hmac
 import logging
+from concurrent.futures import Future
+from functools import lru_cache
 
 from asana.error import InvalidRequestError
-from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 
 from djasana.models import (
@@ -17,10 +19,49 @@ from djasana.models import (
     Task,
     Team,
     User,
+    Webhook,
 )
+from djasana.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Fields of our models that Asana does not have, or has deprecated.
+LOCAL_FIELDS = {
+    "assignee_status",
+    "id",
+    "remote_id",
+    "hearted",
+    "hearts",
+    "last_story_at",
+    "last_story_offset",
+    "num_hearts",
+    "sync_generation",
+    "synced_modified_at",
+    "type",
+}
+
+# How the opt_fields of some models differ from their model fields.
+OPT_FIELDS_OVERRIDES = {
+    Story: {"exclude": ("name",)},
+    Task: {
+        "extra": (
+            "custom_fields.display_value",
+            "custom_fields.enum_value.name",
+            "custom_fields.name",
+            "custom_fields.number_value",
+            "custom_fields.precision",
+            "custom_fields.resource_subtype",
+            "custom_fields.text_value",
+            "num_subtasks",
+        ),
+    },
+    Team: {
+        "exclude": ("organization_id", "organization_name"),
+        "extra": ("organization.gid", "organization.name"),
+    },
+    User: {"exclude": ("photo",), "extra": ("photo.image_128x128",)},
+}
+
 
 def sign_sha256_hmac(secret, message):
     if not isinstance(message, bytes):
@@ -30,6 +71,41 @@ def sign_sha256_hmac(secret, message):
     return hmac.new(secret, message, digestmod=hashlib.sha256).hexdigest()
 
 
+WEBHOOK_SECRET_KEY = "djasana:webhook_secret:{}"
+# Seconds to remember that a project has no webhook, which changes with a handshake
+# served by whichever process Asana reaches.
+NO_WEBHOOK_SECRET_TIMEOUT = 10
+
+
+def get_webhook_secret(project_id, refresh=False):
+    """Returns the secret of the newest webhook of a project, or None.
+
+    Secrets are cached for DJASANA_WEBHOOK_SECRET_CACHE_TIMEOUT seconds, and the
+    absence of one for at most NO_WEBHOOK_SECRET_TIMEOUT, so most deliveries are
+    authenticated without a query. Call forget_webhook_secret when they change;
+    with a per-process cache, other processes see the change when their entry
+    expires, or when they read it with refresh, which skips the cache.
+    """
+    key = WEBHOOK_SECRET_KEY.format(project_id)
+    secret = None if refresh else cache.get(key)
+    if secret is None:
+        secret = (
+            Webhook.objects.filter(project_id=project_id)
+            .order_by("id")
+            .values_list("secret", flat=True)
+            .last()
+        ) or ""
+        timeout = settings.DJASANA_WEBHOOK_SECRET_CACHE_TIMEOUT
+        if not secret:
+            timeout = min(timeout, NO_WEBHOOK_SECRET_TIMEOUT)
+        cache.set(key, secret, timeout)
+    return secret or None
+
+
+def forget_webhook_secret(project_id):
+    cache.delete(WEBHOOK_SECRET_KEY.format(project_id))
+
+
 def set_webhook(client, project_id):
     target = "{}{}".format(
         settings.DJASANA_WEBHOOK_URL,
@@ -69,19 +145,90 @@ def pop_unsupported_fields(instance_dict, model):
         instance_dict.pop(field)
 
 
-def sync_attachment(client, task, attachment_id):
-    attachment_dict = client.attachments.find_by_id(attachment_id)
+@lru_cache(maxsize=None)
+def get_opt_fields(model):
+    """Returns the opt_fields for requesting complete records of a model from Asana.
+
+    Built from the model's fields, so a list call made with these fields
+    returns everything the sync functions read, and the per-object find_by_id
+    can be skipped. Related objects are requested in compact form (gid and name).
+    """
+    overrides = OPT_FIELDS_OVERRIDES.get(model, {})
+    exclude = overrides.get("exclude", ())
+    opt_fields = set(overrides.get("extra", ()))
+    for field in model._meta.get_fields():
+        if field.name in LOCAL_FIELDS or field.name in exclude:
+            continue
+        if field.auto_created and not field.concrete:
+            continue  # A reverse relation
+        if field.many_to_many and not field.remote_field.through._meta.auto_created:
+            continue  # Has its own endpoint, like custom_field_settings
+        if field.is_relation:
+            opt_fields.update((f"{field.name}.gid", f"{field.name}.name"))
+        else:
+            opt_fields.add(field.name)
+    return tuple(sorted(opt_fields))
+
+
+def is_complete(record, opt_fields):
+    """Returns True if a record from Asana has every field in opt_fields"""
+    return {field.split(".")[0] for field in opt_fields} <= record.keys()
+
+
+def coalesce_events(events):
+    """Collapses a list of Asana events into the last event of each resource.
+
+    A task edited ten times needs syncing once, in its final state. So for each
+    (resource type, gid) only the last event is kept, in the place it arrived.
+    Events that are not about a resource, like sync_error, are all kept.
+    """
+    coalesced = {}
+    for index, event in enumerate(events):
+        resource = event.get("resource") or {}
+        if not resource.get("gid"):
+            coalesced[index] = event
+            continue
+        key = (event.get("type") or resource.get("resource_type"), resource["gid"])
+        coalesced.pop(key, None)
+        coalesced[key] = event
+    return list(coalesced.values())
+
+
+def sync_attachment(client, task, attachment_id, attachment_dict=None, writer=None):
+    """Syncs an attachment of a task.
+
+    The full attachment record is fetched from Asana unless it is passed in, either
+    as a dict or as the future of a batched read.
+    With a BulkWriter, task may be the remote_id of the task and the attachment
+    is buffered rather than written.
+    """
+    if attachment_dict is None:
+        attachment_dict = client.attachments.find_by_id(attachment_id)
+    elif isinstance(attachment_dict, Future):
+        attachment_dict = attachment_dict.result()
     logger.debug(attachment_dict)
     remote_id = attachment_dict["gid"]
     attachment_dict.pop("num_annotations", None)
     attachment_dict.pop("num_incomplete_annotations", None)
+    if writer:
+        if attachment_dict.pop("parent", None):
+            attachment_dict["parent_id"] = getattr(task, "remote_id", task)
+        pop_unsupported_fields(attachment_dict, Attachment)
+        writer.insert(Attachment, remote_id, attachment_dict)
+        return
     if attachment_dict["parent"]:
         attachment_dict["parent"] = task
     pop_unsupported_fields(attachment_dict, Attachment)
     Attachment.objects.get_or_create(remote_id=remote_id, defaults=attachment_dict)
 
 
-def sync_project(client, project_dict):
+def sync_project(client, project_dict, writer=None, custom_fields=None):
+    """Creates or updates a project and its members, followers, and status.
+
+    With a BulkWriter, members, followers and custom field settings are buffered
+    rather than written. custom_fields is an optional CustomFieldCache to read the
+    definitions of custom fields from.
+    """
     remote_id = project_dict["gid"]
     if project_dict["owner"]:
         owner = project_dict.pop("owner")
@@ -106,11 +253,13 @@ def sync_project(client, project_dict):
         remote_id=remote_id, defaults=project_dict
     )[0]
     member_ids = [member["gid"] for member in members_dict]
-    members = User.objects.filter(id__in=member_ids)
-    project.members.set(members)
     follower_ids = [follower["gid"] for follower in followers_dict]
-    followers = User.objects.filter(id__in=follower_ids)
-    project.followers.set(followers)
+    if writer:
+        writer.set_m2m(Project, "members", remote_id, member_ids)
+        writer.set_m2m(Project, "followers", remote_id, follower_ids)
+    else:
+        project.members.set(User.objects.filter(remote_id__in=member_ids))
+        project.followers.set(User.objects.filter(remote_id__in=follower_ids))
     if project_status_dict:
         user = None
         created_by = project_status_dict.pop('created_by')
@@ -139,48 +288,88 @@ def sync_project(client, project_dict):
             custom_field_settings,
             project_dict["workspace_id"],
             project.remote_id,
+            writer=writer,
+            custom_fields=custom_fields,
         )
     return project
 
 
-def sync_story(remote_id, story_dict):
+def sync_story(remote_id, story_dict, writer=None):
+    """Creates a story if it does not exist yet; stories are never updated.
+
+    With a BulkWriter, the story is buffered rather than written.
+    """
     if story_dict["created_by"]:
-        user = User.objects.get_or_create(
-            remote_id=story_dict["created_by"]["gid"],
-            defaults={"name": story_dict["created_by"]["name"]},
-        )[0]
-        story_dict["created_by"] = user
+        created_by = story_dict.pop("created_by")
+        if writer:
+            writer.insert(User, created_by["gid"], {"name": created_by["name"]})
+            story_dict["created_by_id"] = created_by["gid"]
+        else:
+            story_dict["created_by"] = User.objects.get_or_create(
+                remote_id=created_by["gid"],
+                defaults={"name": created_by["name"]},
+            )[0]
     if story_dict["target"]:
         story_dict["target"] = story_dict["target"]["gid"]
     pop_unsupported_fields(story_dict, Story)
-    if "text" in story_dict:
+    if story_dict.get("text"):
         story_dict["text"] = story_dict["text"][:1024]  # Truncate text if too long
-    Story.objects.get_or_create(remote_id=remote_id, defaults=story_dict)
+    if writer:
+        writer.insert(Story, remote_id, story_dict)
+    else:
+        Story.objects.get_or_create(remote_id=remote_id, defaults=story_dict)
 
 
-def sync_task(remote_id, task_dict, project, sync_tags=False):
+def sync_task(remote_id, task_dict, project, sync_tags=False, writer=None):
+    """Creates or updates a task and its followers, tags, and projects.
+
+    With a BulkWriter, the task and its relations are buffered rather than written,
+    and None is returned instead of the task.
+    """
     if task_dict["assignee"]:
-        user = User.objects.get_or_create(
-            remote_id=task_dict["assignee"]["gid"],
-            defaults={"name": task_dict["assignee"]["name"]},
-        )[0]
-        task_dict["assignee"] = user
+        assignee = task_dict.pop("assignee")
+        if writer:
+            writer.insert(User, assignee["gid"], {"name": assignee["name"]})
+            task_dict["assignee_id"] = assignee["gid"]
+        else:
+            task_dict["assignee"] = User.objects.get_or_create(
+                remote_id=assignee["gid"],
+                defaults={"name": assignee["name"]},
+            )[0]
     for key in (
         "hearts",
+        "id",
         "liked",
         "likes",
         "num_likes",
         "memberships",
-        "projects",
         "workspace",
     ):
         task_dict.pop(key, None)
+    projects_dict = task_dict.pop("projects", None) or []
     followers_dict = task_dict.pop("followers")
     tags_dict = task_dict.pop("tags")
     pop_unsupported_fields(task_dict, Task)
+    if writer:
+        writer.upsert(Task, remote_id, task_dict)
+        writer.set_m2m(
+            Task,
+            "followers",
+            remote_id,
+            [follower["gid"] for follower in followers_dict],
+        )
+        if sync_tags:
+            for tag_ in tags_dict:
+                writer.insert(Tag, tag_["gid"], {"name": tag_["name"]})
+            writer.add_m2m(Task, "tags", remote_id, [tag_["gid"] for tag_ in tags_dict])
+        project_ids = [project_["gid"] for project_ in projects_dict]
+        if project:
+            project_ids.append(project.remote_id)
+        writer.add_m2m(Task, "projects", remote_id, project_ids)
+        return None
     task = Task.objects.update_or_create(remote_id=remote_id, defaults=task_dict)[0]
     follower_ids = [follower["gid"] for follower in followers_dict]
-    followers = User.objects.filter(id__in=follower_ids)
+    followers = User.objects.filter(remote_id__in=follower_ids)
     task.followers.set(followers)
     if sync_tags:
         for tag_ in tags_dict:
@@ -192,36 +381,75 @@ def sync_task(remote_id, task_dict, project, sync_tags=False):
     return task
 
 
-def sync_custom_fields(client, custom_field_settings, workspace_id, project_id):
-    synced_ids = []
+def sync_custom_fields(
+        client,
+        custom_field_settings,
+        workspace_id,
+        project_id,
+        writer=None,
+        custom_fields=None,
+):
+    """Creates or updates the custom fields of a project and their settings.
+
+    With a CustomFieldCache, definitions come from the cache and each custom field
+    is written once per run; otherwise each one is read with find_by_id. With a
+    BulkWriter, the fields and settings are buffered rather than written.
+    """
+    synced_ids = custom_fields.written if custom_fields else set()
     for setting in custom_field_settings:
         custom_field_mini_dict = setting.pop("custom_field")
         setting.pop("project")
         custom_field_remote_id = custom_field_mini_dict["gid"]
         if custom_field_remote_id not in synced_ids:
-            custom_field_dict = client.custom_fields.find_by_id(custom_field_remote_id)
-            if custom_field_dict["created_by"]:
-                created_by = custom_field_dict.get('created_by')
-                if created_by and created_by.get('gid'):
-                    gid = created_by.get('gid')
-                    user = User.objects.filter(gid=gid).first()
-                    if not user:
-                        user = User(
-                            gid=gid,
-                            name=created_by.get('name'),
-                            resource_type=created_by.get('resource_type'),
-                            remote_id=gid
-                        )
-                        user.save()
-                    custom_field_dict['created_by'] = user
-            CustomField.objects.update_or_create(
-                remote_id=custom_field_remote_id, defaults=custom_field_dict
-            )
-            synced_ids.append(custom_field_remote_id)
+            if custom_fields:
+                custom_field_dict = custom_fields.get(
+                    workspace_id, custom_field_remote_id
+                )
+            else:
+                custom_field_dict = client.custom_fields.find_by_id(
+                    custom_field_remote_id
+                )
+            sync_custom_field(custom_field_remote_id, custom_field_dict, writer)
+            synced_ids.add(custom_field_remote_id)
         setting_remote_id = setting["gid"]
         pop_unsupported_fields(setting, CustomFieldSetting)
         setting["custom_field_id"] = custom_field_remote_id
         setting["project_id"] = project_id
-        CustomFieldSetting.objects.update_or_create(
-            remote_id=setting_remote_id, workspace_id=workspace_id, defaults=setting
+        if writer:
+            setting["workspace_id"] = workspace_id
+            writer.upsert(CustomFieldSetting, setting_remote_id, setting)
+        else:
+            CustomFieldSetting.objects.update_or_create(
+                remote_id=setting_remote_id, workspace_id=workspace_id, defaults=setting
+            )
+
+
+def sync_custom_field(remote_id, custom_field_dict, writer=None):
+    """Creates or updates the definition of a custom field.
+
+    With a BulkWriter, the custom field is buffered rather than written.
+    """
+    created_by = custom_field_dict.pop("created_by", None)
+    if created_by and created_by.get("gid"):
+        gid = created_by["gid"]
+        if writer:
+            writer.insert(User, gid, {"name": created_by.get("name")})
+            custom_field_dict["created_by_id"] = gid
+        else:
+            user = User.objects.filter(gid=gid).first()
+            if not user:
+                user = User(
+                    gid=gid,
+                    name=created_by.get('name'),
+                    resource_type=created_by.get('resource_type'),
+                    remote_id=gid
+                )
+                user.save()
+            custom_field_dict["created_by"] = user
+    pop_unsupported_fields(custom_field_dict, CustomField)
+    if writer:
+        writer.upsert(CustomField, remote_id, custom_field_dict)
+    else:
+        CustomField.objects.update_or_create(
+            remote_id=remote_id, defaults=custom_field_dict
         )
@@ -1,7 +1,11 @@
+import hmac
+import json
 import logging
+import traceback
 
 from asana.error import ForbiddenError, NotFoundError
 from braces.views import JSONRequestResponseMixin
+from django.db import transaction
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
@@ -9,9 +13,15 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from requests.packages.urllib3.exceptions import RequestError
 
+from .bulk import BulkWriter
 from .connect import client_connect
-from .models import Project, Task, Webhook
+from .events import log_events
+from .models import Project, Task, Webhook, WebhookDelivery
+from .settings import settings
 from .utils import (
+    coalesce_events,
+    forget_webhook_secret,
+    get_webhook_secret,
     sign_sha256_hmac,
     sync_project,
     sync_story,
@@ -28,15 +38,22 @@ class WebhookView(JSONRequestResponseMixin, View):
     to projects, tasks, and stories."""
 
     client = None
+    record_events = True
+    writer = None
 
     def post(self, request, *_, **kwargs):
-        """Authenticates a request and processes a collection of events."""
+        """Authenticates a request and processes a collection of events.
+
+        Events are authenticated with the cached secret of the project's webhook.
+        If that does not match, the secret is read from the database once more,
+        since it may have been rotated by another process.
+        """
         remote_id = kwargs.pop("remote_id")
-        project = get_object_or_404(Project, remote_id=remote_id)
         secret = request.META.get(
             "X-Hook-Secret", request.META.get("HTTP_X_HOOK_SECRET")
         )
         if secret:
+            get_object_or_404(Project, remote_id=remote_id)
             return self._process_secret(request, secret, remote_id)
         signature = request.META.get(
             "X-Hook-Signature", request.META.get("HTTP_X_HOOK_SIGNATURE")
@@ -46,23 +63,49 @@ class WebhookView(JSONRequestResponseMixin, View):
             return HttpResponseForbidden()
         if len(signature) != 64:
             logger.debug("Signature of length %s not allowed", len(signature))
+            return HttpResponseForbidden()
         if not self.request_json:
             logger.debug("No json payload")
             return HttpResponseForbidden()
         logger.debug(self.request_json)
-        webhook = Webhook.objects.filter(project_id=remote_id).order_by("id").last()
-        if not webhook:
-            logger.debug("No matching webhook")
-            return HttpResponseForbidden()
-        target_signature = sign_sha256_hmac(webhook.secret, self.request.body)
-        if signature != target_signature:
-            logger.debug("Signature mismatch")
-            return HttpResponseForbidden()
+        if not self._is_signed(signature, get_webhook_secret(remote_id)):
+            # The secret may have changed in another process; read it once more.
+            webhook_secret = get_webhook_secret(remote_id, refresh=True)
+            if not webhook_secret:
+                logger.debug("No matching webhook")
+                return HttpResponseForbidden()
+            if not self._is_signed(signature, webhook_secret):
+                logger.debug("Signature mismatch")
+                return HttpResponseForbidden()
         logger.debug("Signatures match!!")
         if self.request_json["events"]:
-            self._process_events(self.request_json["events"], project)
+            if settings.DJASANA_WEBHOOK_INBOX:
+                # Answer Asana at once; process_asana_webhooks handles the events.
+                with transaction.atomic():
+                    if self.record_events:
+                        log_events(self.request_json["events"], remote_id)
+                    WebhookDelivery.objects.create(
+                        project_id=remote_id, payload=self.request.body.decode("utf-8")
+                    )
+            else:
+                project = get_object_or_404(Project, remote_id=remote_id)
+                failures = self._process_events(self.request_json["events"], project)
+                if failures:
+                    # Asana would send the whole delivery again; a sync catches up.
+                    logger.warning(
+                        "%s of %s events of project %s failed; please sync",
+                        len(failures),
+                        len(self.request_json["events"]),
+                        remote_id,
+                    )
         return HttpResponse()
 
+    def _is_signed(self, signature, webhook_secret):
+        if not webhook_secret:
+            return False
+        target_signature = sign_sha256_hmac(webhook_secret, self.request.body)
+        return hmac.compare_digest(signature.encode(), target_signature.encode())
+
     @staticmethod
     def _process_secret(request, secret, remote_id):
         """Process a request from Asana to establish a web hook"""
@@ -76,38 +119,62 @@ class WebhookView(JSONRequestResponseMixin, View):
         elif webhook.secret != secret:
             webhook.secret = secret
             webhook.save()
+        forget_webhook_secret(remote_id)
         response = HttpResponse()
         response["X-Hook-Secret"] = secret
         logger.debug("Secret accepted")
         return response
 
     def _process_events(self, events, project):
+        """Applies a delivery of events in one transaction.
+
+        Writes are buffered in a BulkWriter and flushed after each event, inside a
+        savepoint of that event, so an event that fails is rolled back alone and the
+        others are committed. Returns the events that failed, each with the
+        traceback of its error.
+        """
         logger.debug("Processing events")
         self.client = client_connect()
-        for event in events:
-            if event["action"] == "deleted":
-                # Assumes its a task
-                Task.objects.filter(remote_id=event["resource"]["gid"]).delete()
-            elif event["action"] == "sync_error":
-                logger.warning(event["message"])
-            elif event["resource"]["resource_type"] == "project":
-                if event["action"] == "removed":
-                    Project.objects.get(remote_id=event["resource"]["gid"]).delete()
-                else:
-                    self._sync_project(project)
-            elif event["resource"]["resource_type"] == "task":
-                if event["action"] == "removed":
-                    Task.objects.get(remote_id=event["resource"]["gid"]).delete()
-                else:
-                    self._sync_task_id(event["resource"]["gid"], project)
-            elif event["resource"]["resource_type"] == "story":
-                self._sync_story_id(event["resource"]["gid"])
+        self.writer = BulkWriter()
+        failures = []
+        with transaction.atomic():
+            if self.record_events:
+                log_events(events, project.remote_id)
+            for event in coalesce_events(events):
+                try:
+                    with transaction.atomic():
+                        self._process_event(event, project)
+                        self.writer.flush()
+                except Exception:
+                    logger.exception("Error processing event %s", event)
+                    self.writer.clear()
+                    failures.append((event, traceback.format_exc()))
+        return failures
+
+    def _process_event(self, event, project):
+        if event["action"] == "deleted":
+            # Assumes its a task
+            Task.objects.filter(remote_id=event["resource"]["gid"]).delete()
+        elif event["action"] == "sync_error":
+            logger.warning(event["message"])
+        elif event["resource"]["resource_type"] == "project":
+            if event["action"] == "removed":
+                Project.objects.get(remote_id=event["resource"]["gid"]).delete()
+            else:
+                self._sync_project(project)
+        elif event["resource"]["resource_type"] == "task":
+            if event["action"] == "removed":
+                Task.objects.get(remote_id=event["resource"]["gid"]).delete()
+            else:
+                self._sync_task_id(event["resource"]["gid"], project)
+        elif event["resource"]["resource_type"] == "story":
+            self._sync_story_id(event["resource"]["gid"])
 
     def _sync_project(self, project):
         project_dict = self.client.projects.find_by_id(project.remote_id)
         logger.debug("Sync project %s", project_dict["name"])
         logger.debug(project_dict)
-        sync_project(self.client, project_dict)
+        sync_project(self.client, project_dict, writer=self.writer)
 
     def _sync_story_id(self, story_id):
         try:
@@ -121,7 +188,7 @@ class WebhookView(JSONRequestResponseMixin, View):
             return
         logger.debug(story_dict)
         story_dict.pop("gid", None)
-        sync_story(story_id, story_dict)
+        sync_story(story_id, story_dict, writer=self.writer)
 
     def _sync_task_id(self, task_id, project):
         try:
@@ -138,6 +205,36 @@ class WebhookView(JSONRequestResponseMixin, View):
         if task_dict["parent"]:
             self._sync_task_id(task_dict["parent"]["gid"], project)
             task_dict["parent_id"] = task_dict.pop("parent")["gid"]
-        task = sync_task(task_id, task_dict, project, sync_tags=True)
-        for attachment in self.client.attachments.find_by_task(task_id):
-            sync_attachment(self.client, task, attachment["gid"])
+        sync_task(task_id, task_dict, project, sync_tags=True, writer=self.writer)
+        with self.client.batch() as batch:
+            attachments = [
+                (attachment["gid"], batch.get(f"/attachments/{attachment['gid']}"))
+                for attachment in self.client.attachments.find_by_task(task_id)
+            ]
+        for attachment_id, attachment_dict in attachments:
+            sync_attachment(
+                self.client, task_id, attachment_id, attachment_dict, writer=self.writer
+            )
+
+
+def process_events(events, project, record=True):
+    """Processes webhook events of a project outside of a request.
+
+    With record, the events are appended to the event log first. Returns the
+    events that failed, each with the traceback of its error.
+    """
+    view = WebhookView()
+    view.record_events = record
+    return view._process_events(events, project)
+
+
+def process_delivery(delivery):
+    """Processes the events of a webhook delivery from the inbox.
+
+    The events were logged when the delivery was received. Returns the events
+    that failed, each with the traceback of its error.
+    """
+    events = json.loads(delivery.payload)["events"]
+    if not events:
+        return []
+    return process_events(events, delivery.project, record=False)
@@ -118,4 +118,5 @@ setup(
         "django-braces>=1.14",
         "requests>=2.31.0",
     ],
+    extras_require={"async": ["httpx>=0.23"]},
 )